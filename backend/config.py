@@ -14,26 +14,74 @@ COUNCIL_MODELS = [
         "id": "openai/gpt-5.1",
         "name": "GPT-5.1",
         "role": "chairman",  # Chairman synthesizes final answer
-        "color": "#10a37f"  # OpenAI green
+        "color": "#10a37f",  # OpenAI green
+        "max_parallel": 4  # Max concurrent requests to this model
     },
     {
         "id": "google/gemini-3-pro-preview",
         "name": "Gemini 3 Pro",
         "role": "participant", 
-        "color": "#4285f4"  # Google blue
+        "color": "#4285f4",  # Google blue
+        "max_parallel": 4
     },
 ]
 
 # Get chairman model
 CHAIRMAN_MODEL = next(m for m in COUNCIL_MODELS if m["role"] == "chairman")
 
+# OpenRouter request limits
+DEFAULT_MAX_PARALLEL_PER_MODEL = 4  # Used when a model has no "max_parallel"
+MAX_RETRIES = 3  # Retries on HTTP 429/5xx, with exponential backoff
+RETRY_BASE_DELAY_SECONDS = 1.0
+HTTP_MAX_CONNECTIONS = 64  # Shared HTTP/2 connection pool to OpenRouter
+HTTP_MAX_KEEPALIVE_CONNECTIONS = 32
+
 # Discussion settings
 MAX_DISCUSSION_ROUNDS = 3
 CONSENSUS_TIMEOUT_SECONDS = 120
 
+# Early exit from discussion: stop when responses barely change between rounds
+# (word-set Jaccard similarity) or when every model is confident after round 2+
+DISCUSSION_CONVERGENCE_RATIO = 0.85
+DISCUSSION_CONFIDENCE_THRESHOLD = 0.8
+
+# Rounds older than the latest are summarized by key points, capped at this size
+DISCUSSION_SUMMARY_MAX_CHARS = 1500
+
+# Cache of full council results for repeated queries (same question, history and files)
+COUNCIL_CACHE_SIZE = 1024
+COUNCIL_CACHE_TTL_SECONDS = int(os.getenv("COUNCIL_CACHE_TTL_SECONDS", "3600"))
+COUNCIL_CACHE_HISTORY_MESSAGES = 10
+
+# Serialize council context (responses, discussion rounds) in compact TOON format.
+# Set USE_TOON_CONTEXT=false to fall back to the verbose "=== Модель X ===" blocks.
+USE_TOON_CONTEXT = os.getenv("USE_TOON_CONTEXT", "true").lower() in ("1", "true", "yes")
+
+# SSE comment sent when a stream has been silent this long, so proxies
+# don't close the connection during long discussion rounds
+SSE_HEARTBEAT_SECONDS = 15
+
+# Chats still carrying one of these titles are renamed after their first message
+DEFAULT_TITLES = frozenset({"New Chat", "Новый чат"})
+CHAT_TITLE_MAX_CHARS = 50
+
 # Database
 DATA_DIR = Path(os.getenv("DATA_DIR", "./data"))
 DATABASE_URL = f"sqlite+aiosqlite:///{DATA_DIR}/council.db"
+DB_POOL_SIZE = 20
+DB_MAX_OVERFLOW = 10
+DB_POOL_TIMEOUT_SECONDS = 30
+DB_POOL_RECYCLE_SECONDS = 3600
+
+# Optional Redis cache for chat reads (GET /api/chats, /api/chats/{id}).
+# Leave REDIS_URL empty to disable; every read then goes to SQLite.
+REDIS_URL = os.getenv("REDIS_URL", "")
+CHAT_CACHE_TTL_SECONDS = 300
+CHAT_CACHE_REBUILD_LOCK_SECONDS = 5
+# Per-chat version counters expire after this long without writes. It must
+# exceed CHAT_CACHE_TTL_SECONDS so every payload cached under an old version
+# is gone before the counter restarts from zero.
+CHAT_VERSION_TTL_SECONDS = 24 * 3600
 
 # File uploads configuration
 UPLOADS_DIR = DATA_DIR / "uploads"
@@ -44,9 +92,12 @@ MAX_FILE_SIZE_BYTES = MAX_FILE_SIZE_MB * 1024 * 1024
 MAX_TOTAL_SIZE_BYTES = MAX_TOTAL_SIZE_MB * 1024 * 1024
 
 # Allowed file extensions and MIME types
-ALLOWED_EXTENSIONS = {
-    # Documents
+DOCUMENT_EXTENSIONS = frozenset({
     ".pdf", ".docx", ".doc", ".xlsx", ".xls", ".pptx", ".ppt",
+})
+
+# Text-based extensions that can be read directly
+TEXT_EXTENSIONS = frozenset({
     # Text/Code
     ".txt", ".md", ".json", ".xml", ".csv", ".yaml", ".yml",
     ".py", ".js", ".ts", ".jsx", ".tsx", ".html", ".css", ".scss",
@@ -54,7 +105,9 @@ ALLOWED_EXTENSIONS = {
     ".php", ".sql", ".sh", ".bash", ".zsh", ".ps1",
     # Config
     ".ini", ".cfg", ".conf", ".env", ".toml",
-}
+})
+
+ALLOWED_EXTENSIONS = DOCUMENT_EXTENSIONS | TEXT_EXTENSIONS
 
 # Max characters to extract from each file for context
 MAX_CHARS_PER_FILE = 10000
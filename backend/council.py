@@ -1,13 +1,23 @@
 """
 LLM Council logic - orchestrates multi-model discussions to reach consensus.
 """
+import re
 import json
 import asyncio
-from typing import AsyncGenerator, Optional
+import hashlib
+import logging
+from typing import Any, AsyncGenerator, Optional
 from datetime import datetime
 
-from .config import COUNCIL_MODELS, CHAIRMAN_MODEL, MAX_DISCUSSION_ROUNDS
-from .openrouter import client
+import orjson
+from cachetools import TTLCache
+
+from .config import (
+    COUNCIL_MODELS, CHAIRMAN_MODEL, MAX_DISCUSSION_ROUNDS, USE_TOON_CONTEXT,
+    COUNCIL_CACHE_SIZE, COUNCIL_CACHE_TTL_SECONDS, COUNCIL_CACHE_HISTORY_MESSAGES,
+    DISCUSSION_CONVERGENCE_RATIO, DISCUSSION_CONFIDENCE_THRESHOLD, DISCUSSION_SUMMARY_MAX_CHARS
+)
+from .openrouter import client, ModelError
 from .schemas import (
     ModelResponse,
     ConsensusResponse,
@@ -17,6 +27,8 @@ from .schemas import (
     StageProgressEvent,
 )
 
+logger = logging.getLogger(__name__)
+
 
 # System prompts for different stages (Russian)
 INITIAL_SYSTEM_PROMPT = """Ты {model_name}, полезный ИИ-ассистент, участвующий в обсуждении совета.
@@ -68,16 +80,110 @@ CHAIRMAN_SYSTEM_PROMPT = """Ты {model_name}, Председатель Сове
 ВАЖНО: Отвечай ТОЛЬКО на русском языке. Пиши красивый, читаемый текст."""
 
 
+# Fixed per-stage instructions, sent first so the prompt prefix stays byte-stable
+DISCUSSION_INSTRUCTIONS = "Пожалуйста, дай свой уточнённый ответ в формате JSON."
+CONSENSUS_INSTRUCTIONS = "Сформулируй итоговый ответ на вопрос пользователя, объединив лучшие идеи."
+
+
+def _text_part(text: str, cache: bool = False) -> dict:
+    """
+    Build a text content part of a user message.
+    
+    `cache=True` marks the end of an invariant prefix for provider prompt
+    caching (Anthropic syntax, passed through by OpenRouter).
+    """
+    part = {"type": "text", "text": text}
+    if cache:
+        part["cache_control"] = {"type": "ephemeral"}
+    return part
+
+
+# Outermost {...} span in a model answer (skips markdown fences and chatty preambles)
+JSON_OBJECT_RE = re.compile(r"\{.*\}", re.DOTALL)
+
+# Words for round-to-round answer comparison
+WORD_RE = re.compile(r"\w+")
+_json_decoder = json.JSONDecoder()
+
+
+def _parse_json_response(text: str) -> Optional[dict]:
+    """
+    Parse the JSON object from a model's discussion answer.
+    
+    Tolerates markdown fences and prose before or after the object.
+    Returns None if no JSON object can be decoded.
+    """
+    match = JSON_OBJECT_RE.search(text)
+    if not match:
+        return None
+    candidate = match.group(0)
+    try:
+        parsed = orjson.loads(candidate)
+    except orjson.JSONDecodeError:
+        # Trailing prose may contain braces too - decode only the leading object
+        try:
+            parsed, _ = _json_decoder.raw_decode(candidate)
+        except json.JSONDecodeError:
+            return None
+    return parsed if isinstance(parsed, dict) else None
+
+
+# Characters that force a TOON string value to be quoted
+TOON_SPECIAL_CHARS = frozenset(',:|[]{}"\\\n\r\t')
+
+
+def _toon_value(value) -> str:
+    """Encode a single value for a TOON row."""
+    if isinstance(value, (list, tuple)):
+        return "[" + "|".join(_toon_value(item) for item in value) + "]"
+    if isinstance(value, float):
+        return f"{value:g}"
+    value = str(value)
+    if not value or value != value.strip() or any(c in TOON_SPECIAL_CHARS for c in value):
+        return json.dumps(value, ensure_ascii=False)
+    return value
+
+
+# Anonymous model names by index: "Модель А", "Модель Б", ... (Russian letters А-Я)
+_ANON_NAMES = tuple(f"Модель {chr(1040 + i)}" for i in range(32))
+
+
 class CouncilOrchestrator:
     """Orchestrates multi-model discussions."""
 
     def __init__(self):
         self.models = COUNCIL_MODELS
         self.chairman = CHAIRMAN_MODEL
+        self._name_to_index = {m["name"]: i for i, m in enumerate(self.models)}
+
+        # System prompts only depend on the model, so format them once
+        self._initial_system = {
+            m["id"]: INITIAL_SYSTEM_PROMPT.format(model_name=m["name"]) for m in self.models
+        }
+        self._discussion_system = {
+            m["id"]: DISCUSSION_SYSTEM_PROMPT.format(model_name=m["name"]) for m in self.models
+        }
+        self._chairman_system = CHAIRMAN_SYSTEM_PROMPT.format(model_name=self.chairman["name"])
+        self._result_cache = TTLCache(maxsize=COUNCIL_CACHE_SIZE, ttl=COUNCIL_CACHE_TTL_SECONDS)
 
     def _anonymize_model_name(self, index: int) -> str:
         """Convert model index to anonymous name."""
-        return f"Модель {chr(1040 + index)}"  # А, Б, В (Russian letters)
+        return _ANON_NAMES[index]
+
+    def _toon_encode_responses(self, responses: list[dict], label: str = "responses") -> str:
+        """
+        Encode uniform response records as a TOON table.
+        
+        Format: a `label[N]{field,...}:` header followed by one row per record,
+        strings are JSON-quoted only when needed and lists use `[a|b|c]` syntax.
+        """
+        if not responses:
+            return f"{label}[0]:"
+        fields = list(responses[0].keys())
+        lines = [f"{label}[{len(responses)}]{{{','.join(fields)}}}:"]
+        for record in responses:
+            lines.append("  " + ",".join(_toon_value(record[field]) for field in fields))
+        return "\n".join(lines)
 
     def _format_responses_for_discussion(
         self,
@@ -85,6 +191,13 @@ class CouncilOrchestrator:
         exclude_index: Optional[int] = None
     ) -> str:
         """Format responses for showing to other models (anonymized)."""
+        if USE_TOON_CONTEXT:
+            return self._toon_encode_responses([
+                {"model": self._anonymize_model_name(i), "content": response}
+                for i, (model, response) in enumerate(responses)
+                if exclude_index is None or i != exclude_index
+            ])
+
         formatted = []
         for i, (model, response) in enumerate(responses):
             if exclude_index is not None and i == exclude_index:
@@ -93,6 +206,68 @@ class CouncilOrchestrator:
             formatted.append(f"=== {anon_name} ===\n{response}\n")
         return "\n".join(formatted)
 
+    def _format_round_responses(
+        self,
+        discussion_round: DiscussionRound,
+        name_for: callable
+    ) -> str:
+        """Format one discussion round, naming each model with `name_for(resp)`."""
+        if USE_TOON_CONTEXT:
+            return self._toon_encode_responses([
+                {
+                    "model": name_for(resp),
+                    "content": resp.content,
+                    "confidence": resp.confidence,
+                    "key_points": resp.key_points,
+                }
+                for resp in discussion_round.responses
+            ], label=f"round{discussion_round.round_number}")
+
+        lines = [f"=== Раунд обсуждения {discussion_round.round_number} ==="]
+        for resp in discussion_round.responses:
+            lines.append(f"{name_for(resp)}: {resp.content}")
+        return "\n".join(lines)
+
+    def _format_discussion_context(
+        self,
+        previous_rounds: list[DiscussionRound],
+        max_chars: int = DISCUSSION_SUMMARY_MAX_CHARS
+    ) -> str:
+        """
+        Format previous discussion rounds for the next round.
+        
+        Only the latest round is shown verbatim. Older rounds are collapsed to
+        one key_points line per model, so the context no longer grows
+        quadratically with the number of rounds.
+        """
+        if not previous_rounds:
+            return ""
+
+        def anon_name(resp: ModelMessageResponse) -> str:
+            return self._anonymize_model_name(self._name_to_index[resp.model_name])
+
+        parts = []
+        older_rounds = previous_rounds[:-1]
+        if older_rounds:
+            lines = ["=== Ранние раунды (ключевые моменты) ==="]
+            total_chars = 0
+            # Newest first, so the size limit drops the oldest rounds
+            summaries = [
+                f"[R{prev_round.round_number}] {anon_name(resp)}: key_points={_toon_value(resp.key_points)}"
+                for prev_round in reversed(older_rounds)
+                for resp in prev_round.responses
+            ]
+            for line in summaries:
+                if total_chars + len(line) > max_chars:
+                    lines.append("[... ранние раунды опущены ...]")
+                    break
+                lines.append(line)
+                total_chars += len(line)
+            parts.append("\n".join(lines))
+
+        parts.append(self._format_round_responses(previous_rounds[-1], anon_name))
+        return "\n" + "\n\n".join(parts) + "\n"
+
     def _format_chat_history_toon(self, chat_history: list[dict], max_chars: int = 3000) -> str:
         """
         Format chat history in compact TOON-like format.
@@ -127,6 +302,44 @@ class CouncilOrchestrator:
         
         return "\n".join(lines)
 
+    def _council_cache_key(
+        self,
+        user_query: str,
+        chat_history: list[dict],
+        files_context: str,
+        chat_id: str
+    ) -> str:
+        """Build cache key from the chat, query, recent chat history and attached files."""
+        history_toon = self._format_chat_history_toon(chat_history[-COUNCIL_CACHE_HISTORY_MESSAGES:])
+        digest = hashlib.sha256()
+        for part in (chat_id, user_query, history_toon, files_context):
+            digest.update(part.encode("utf-8"))
+            digest.update(b"\0")
+        return digest.hexdigest()
+
+    def _response_similarity(
+        self,
+        previous: list[ModelMessageResponse],
+        current: list[ModelMessageResponse]
+    ) -> float:
+        """
+        Lowest per-model similarity between two consecutive rounds (0-1).
+        
+        High values mean the models are no longer changing their answers.
+        Compares word sets (Jaccard), which is linear in answer length and
+        cheap enough to run on the event loop.
+        """
+        previous_by_name = {r.model_name: r.content for r in previous}
+        ratios = []
+        for r in current:
+            if r.model_name not in previous_by_name:
+                continue
+            before = set(WORD_RE.findall(previous_by_name[r.model_name].lower()))
+            after = set(WORD_RE.findall(r.content.lower()))
+            union = before | after
+            ratios.append(len(before & after) / len(union) if union else 1.0)
+        return min(ratios, default=0.0)
+
     async def run_initial_stage(
         self,
         user_query: str,
@@ -150,7 +363,7 @@ class CouncilOrchestrator:
         requests = []
         for model in self.models:
             # Build system prompt with TOON history and files context
-            system_content = INITIAL_SYSTEM_PROMPT.format(model_name=model["name"])
+            system_content = self._initial_system[model["id"]]
             if history_toon:
                 system_content += f"\n\n{history_toon}"
             if files_context:
@@ -173,7 +386,7 @@ class CouncilOrchestrator:
         # Process results
         responses = []
         for i, (model, result) in enumerate(zip(self.models, results)):
-            if isinstance(result, Exception):
+            if isinstance(result, ModelError):
                 content = f"Ошибка: {str(result)}"
                 confidence = 0.0
                 key_points = []
@@ -220,35 +433,33 @@ class CouncilOrchestrator:
                 status="started"
             ))
 
-        # Format all previous responses for context
+        # Format all initial responses once - the block is shared verbatim by every
+        # model, each one is only told which anonymous name is its own
         all_responses = [(m, r.content) for m, r in zip(self.models, initial_responses)]
+        responses_block = self._format_responses_for_discussion(all_responses)
         
         # Add previous discussion rounds
-        discussion_context = ""
-        if previous_rounds:
-            for prev_round in previous_rounds:
-                discussion_context += f"\n=== Раунд обсуждения {prev_round.round_number} ===\n"
-                for resp in prev_round.responses:
-                    idx = next(i for i, m in enumerate(self.models) if m["name"] == resp.model_name)
-                    anon_name = self._anonymize_model_name(idx)
-                    discussion_context += f"{anon_name}: {resp.content}\n"
+        discussion_context = self._format_discussion_context(previous_rounds)
 
         # Prepare parallel requests
         requests = []
         for i, model in enumerate(self.models):
-            others_responses = self._format_responses_for_discussion(all_responses, exclude_index=i)
+            own_marker = f"(Твой собственный ответ — {self._anonymize_model_name(i)})\n"
             
             messages = [
                 {
                     "role": "system",
-                    "content": DISCUSSION_SYSTEM_PROMPT.format(model_name=model["name"])
+                    "content": self._discussion_system[model["id"]]
                 },
                 {
+                    # Invariant segments first, volatile discussion last
                     "role": "user",
-                    "content": f"Исходный вопрос: {user_query}\n\n"
-                              f"=== Начальные ответы ===\n{others_responses}\n"
-                              f"{discussion_context}\n"
-                              f"Пожалуйста, дай свой уточнённый ответ в формате JSON."
+                    "content": [
+                        _text_part(DISCUSSION_INSTRUCTIONS),
+                        _text_part(f"Исходный вопрос: {user_query}", cache=True),
+                        _text_part(f"=== Начальные ответы ===\n{responses_block}", cache=True),
+                        _text_part(f"{own_marker}{discussion_context}"),
+                    ]
                 }
             ]
             requests.append({
@@ -264,25 +475,18 @@ class CouncilOrchestrator:
         # Process results
         responses = []
         for i, (model, result) in enumerate(zip(self.models, results)):
-            if isinstance(result, Exception):
+            if isinstance(result, ModelError):
                 content = f"Ошибка: {str(result)}"
                 confidence = 0.0
                 key_points = []
             else:
                 # Try to parse as JSON
-                try:
-                    # Clean up the response - remove markdown code blocks if present
-                    clean_result = result.strip()
-                    if clean_result.startswith("```"):
-                        clean_result = clean_result.split("\n", 1)[1]
-                        if clean_result.endswith("```"):
-                            clean_result = clean_result[:-3]
-                    
-                    parsed = json.loads(clean_result)
+                parsed = _parse_json_response(result)
+                if parsed is not None:
                     content = parsed.get("content", result)
                     confidence = parsed.get("confidence", 0.8)
                     key_points = parsed.get("key_points", [])
-                except (json.JSONDecodeError, AttributeError):
+                else:
                     content = result
                     confidence = 0.8
                     key_points = []
@@ -326,40 +530,63 @@ class CouncilOrchestrator:
             ))
 
         # Format all responses
-        initial_context = ""
-        for i, resp in enumerate(initial_responses):
-            anon_name = self._anonymize_model_name(i)
-            initial_context += f"=== {anon_name} ({resp.model_name}) ===\n{resp.content}\n\n"
-
-        discussion_context = ""
-        for round in discussion_rounds:
-            discussion_context += f"\n=== Раунд обсуждения {round.round_number} ===\n"
-            for resp in round.responses:
-                discussion_context += f"{resp.model_name}: {resp.content}\n\n"
+        if USE_TOON_CONTEXT:
+            initial_context = self._toon_encode_responses([
+                {
+                    "model": f"{self._anonymize_model_name(i)} ({resp.model_name})",
+                    "content": resp.content,
+                }
+                for i, resp in enumerate(initial_responses)
+            ]) + "\n"
+        else:
+            initial_context = ""
+            for i, resp in enumerate(initial_responses):
+                anon_name = self._anonymize_model_name(i)
+                initial_context += f"=== {anon_name} ({resp.model_name}) ===\n{resp.content}\n\n"
+
+        discussion_context = "\n\n".join(
+            self._format_round_responses(round, lambda resp: resp.model_name)
+            for round in discussion_rounds
+        ) + "\n"
 
         messages = [
             {
                 "role": "system",
-                "content": CHAIRMAN_SYSTEM_PROMPT.format(model_name=self.chairman["name"])
+                "content": self._chairman_system
             },
             {
+                # Invariant segments first, volatile discussion last
                 "role": "user",
-                "content": f"Вопрос пользователя: {user_query}\n\n"
-                          f"=== Начальные ответы членов совета ===\n{initial_context}\n"
-                          f"=== Дискуссия ===\n{discussion_context}\n"
-                          f"Сформулируй итоговый ответ на вопрос пользователя, объединив лучшие идеи."
+                "content": [
+                    _text_part(CONSENSUS_INSTRUCTIONS),
+                    _text_part(f"Вопрос пользователя: {user_query}", cache=True),
+                    _text_part(
+                        f"=== Начальные ответы членов совета ===\n{initial_context}\n"
+                        f"=== Дискуссия ===\n{discussion_context}"
+                    ),
+                ]
             }
         ]
 
-        result = await client.chat_completion(
-            model=self.chairman["id"],
-            messages=messages,
-            temperature=0.5,
-            max_tokens=4096,
-        )
+        # Stream the answer so the user sees it while the chairman is still writing
+        chunks = []
+        async for chunk in client.stream_with_retry({
+            "model": self.chairman["id"],
+            "messages": messages,
+            "temperature": 0.5,
+            "max_tokens": 4096,
+        }):
+            chunks.append(chunk)
+            if on_progress:
+                await on_progress(StageProgressEvent(
+                    stage=StageType.CONSENSUS,
+                    model_name=self.chairman["name"],
+                    status="streaming",
+                    partial_content=chunk
+                ))
 
         # Chairman now returns plain markdown text, not JSON
-        final_answer = result.strip()
+        final_answer = "".join(chunks).strip()
         
         # Remove any accidental code block wrappers
         if final_answer.startswith("```") and final_answer.endswith("```"):
@@ -388,7 +615,9 @@ class CouncilOrchestrator:
         user_query: str,
         chat_history: list[dict] = None,
         on_progress: Optional[callable] = None,
-        files_context: str = ""
+        files_context: str = "",
+        force_refresh: bool = False,
+        chat_id: str = ""
     ) -> dict:
         """
         Run the complete council process:
@@ -396,20 +625,36 @@ class CouncilOrchestrator:
         2. Discussion rounds (up to MAX_DISCUSSION_ROUNDS)
         3. Chairman synthesizes final answer
         
+        Results are cached per chat for COUNCIL_CACHE_TTL_SECONDS, so retries
+        and duplicate submissions of the same query reuse the previous
+        discussion; the same question in another chat runs the council again.
+        
         Args:
             user_query: Current user message
             chat_history: Previous messages in chat for context
             on_progress: Callback for progress updates
             files_context: Extracted text from uploaded files
+            force_refresh: Ignore cached result and run the council again
+            chat_id: Chat the message belongs to (part of the cache key)
         """
+        cache_key = self._council_cache_key(user_query, chat_history or [], files_context, chat_id)
+        if not force_refresh:
+            cached = self._result_cache.get(cache_key)
+            if cached is not None:
+                return dict(cached)
+
         # Stage 1: Initial responses
         initial_responses = await self.run_initial_stage(
             user_query, chat_history, on_progress, files_context
         )
 
-        # Stage 2: Discussion rounds
+        # Stage 2: Discussion rounds. Every council model (chairman included) takes
+        # part; with a single model there is nobody to discuss with, and more
+        # voices than rounds are not needed
+        discussants = len(self.models)
+        max_rounds = min(MAX_DISCUSSION_ROUNDS, discussants) if discussants >= 2 else 0
         discussion_rounds = []
-        for round_num in range(1, MAX_DISCUSSION_ROUNDS + 1):
+        for round_num in range(1, max_rounds + 1):
             round_result = await self.run_discussion_round(
                 user_query,
                 initial_responses,
@@ -417,13 +662,32 @@ class CouncilOrchestrator:
                 round_num,
                 on_progress
             )
+            previous_responses = discussion_rounds[-1].responses if discussion_rounds else initial_responses
             discussion_rounds.append(round_result)
 
             # Check if we can end early (high confidence across all)
             avg_confidence = sum(r.confidence for r in round_result.responses) / len(round_result.responses)
             if avg_confidence > 0.95:
+                logger.info("Round %d: average confidence %.2f, ending discussion", round_num, avg_confidence)
                 break
 
+            # Responses converged - another round would add little
+            similarity = self._response_similarity(previous_responses, round_result.responses)
+            if similarity > DISCUSSION_CONVERGENCE_RATIO:
+                logger.info("Round %d: responses converged (similarity %.2f), ending discussion", round_num, similarity)
+                break
+
+            if len(discussion_rounds) >= 2 and all(
+                r.confidence >= DISCUSSION_CONFIDENCE_THRESHOLD for r in round_result.responses
+            ):
+                logger.info("Round %d: all models confident, ending discussion", round_num)
+                break
+
+            logger.info(
+                "Round %d: average confidence %.2f, similarity %.2f, continuing",
+                round_num, avg_confidence, similarity
+            )
+
         # Stage 3: Consensus
         consensus = await self.run_consensus_stage(
             user_query,
@@ -432,12 +696,46 @@ class CouncilOrchestrator:
             on_progress
         )
 
-        return {
+        result = {
             "initial_responses": initial_responses,
             "discussion_rounds": discussion_rounds,
             "consensus": consensus
         }
 
+        # Only cache runs where every model answered
+        all_responses = initial_responses + [r for rnd in discussion_rounds for r in rnd.responses]
+        if not any(r.content.startswith("Ошибка:") for r in all_responses):
+            self._result_cache[cache_key] = result
+
+        return dict(result)
+
+    async def run_full_council_stream(
+        self,
+        user_query: str,
+        chat_history: list[dict] = None,
+        files_context: str = "",
+        force_refresh: bool = False,
+        chat_id: str = ""
+    ) -> AsyncGenerator[tuple[str, Any], None]:
+        """
+        Run the complete council, yielding ("progress", StageProgressEvent) as
+        soon as each stage reports and finally ("result", result dict).
+        
+        Closing the generator (client disconnected) cancels the council run.
+        """
+        events: asyncio.Queue = asyncio.Queue()
+        task = asyncio.create_task(self.run_full_council(
+            user_query, chat_history, events.put, files_context, force_refresh, chat_id
+        ))
+        # None marks the end of the run, so the loop below never has to poll
+        task.add_done_callback(lambda _: events.put_nowait(None))
+        try:
+            while (event := await events.get()) is not None:
+                yield "progress", event
+            yield "result", task.result()
+        finally:
+            task.cancel()
+
 
 # Global orchestrator instance
 orchestrator = CouncilOrchestrator()
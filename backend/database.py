@@ -2,15 +2,41 @@
 Database models and connection management using SQLAlchemy async.
 """
 import uuid
-from datetime import datetime
-from typing import Optional
-from sqlalchemy import Column, String, Text, DateTime, ForeignKey, JSON, Enum as SQLEnum
+import asyncio
+import logging
+from typing import Any, Awaitable, Callable, Optional
+
+import orjson
+from redis.asyncio import Redis
+from redis.exceptions import RedisError
+from sqlalchemy import Column, String, Text, DateTime, ForeignKey, JSON, Index, Enum as SQLEnum, event, update
 from sqlalchemy.ext.asyncio import create_async_engine, AsyncSession, async_sessionmaker
 from sqlalchemy.orm import DeclarativeBase, relationship
-
-from .config import DATABASE_URL
+from sqlalchemy.sql import func
+
+from .config import (
+    DATABASE_URL, DB_POOL_SIZE, DB_MAX_OVERFLOW,
+    DB_POOL_TIMEOUT_SECONDS, DB_POOL_RECYCLE_SECONDS,
+    REDIS_URL, CHAT_CACHE_TTL_SECONDS, CHAT_CACHE_REBUILD_LOCK_SECONDS,
+    CHAT_VERSION_TTL_SECONDS
+)
 from .schemas import MessageRole, StageType
 
+logger = logging.getLogger(__name__)
+
+
+def utc_now():
+    """
+    SQL expression for the current UTC time, evaluated by SQLite.
+    
+    CURRENT_TIMESTAMP only has second precision, so messages written within
+    the same second would sort ambiguously; keep milliseconds instead.
+    Columns use it both as `default` (rendered into every INSERT, so tables
+    created before the server default existed still get a value) and as
+    `server_default` for new tables.
+    """
+    return func.strftime("%Y-%m-%d %H:%M:%f", "now")
+
 
 class Base(DeclarativeBase):
     pass
@@ -19,24 +45,36 @@ class Base(DeclarativeBase):
 class Chat(Base):
     """Chat/conversation model."""
     __tablename__ = "chats"
+    __table_args__ = (
+        Index("ix_chats_updated", "updated_at"),  # Sidebar ordering
+    )
+    # Fetch server-generated timestamps on flush (no lazy load in async code)
+    __mapper_args__ = {"eager_defaults": True}
 
     id = Column(String(36), primary_key=True, default=lambda: str(uuid.uuid4()))
     title = Column(String(255), nullable=False, default="Новый чат")
-    created_at = Column(DateTime, default=datetime.utcnow)
-    updated_at = Column(DateTime, default=datetime.utcnow, onupdate=datetime.utcnow)
+    created_at = Column(DateTime, default=utc_now(), server_default=utc_now())
+    updated_at = Column(DateTime, default=utc_now(), server_default=utc_now(), onupdate=utc_now())
 
-    messages = relationship("Message", back_populates="chat", cascade="all, delete-orphan")
+    messages = relationship(
+        "Message", back_populates="chat", cascade="all, delete-orphan",
+        order_by="Message.created_at"
+    )
 
 
 class Message(Base):
     """Message model storing both user and assistant messages."""
     __tablename__ = "messages"
+    __table_args__ = (
+        Index("ix_messages_chat_created", "chat_id", "created_at"),  # Chat history loads
+    )
+    __mapper_args__ = {"eager_defaults": True}
 
     id = Column(String(36), primary_key=True, default=lambda: str(uuid.uuid4()))
     chat_id = Column(String(36), ForeignKey("chats.id", ondelete="CASCADE"), nullable=False)
     role = Column(SQLEnum(MessageRole), nullable=False)
     content = Column(Text, nullable=False)
-    created_at = Column(DateTime, default=datetime.utcnow)
+    created_at = Column(DateTime, default=utc_now(), server_default=utc_now())
 
     # Discussion metadata (JSON for flexibility)
     discussion_data = Column(JSON, nullable=True)
@@ -48,6 +86,7 @@ class Message(Base):
 class Attachment(Base):
     """File attachment model."""
     __tablename__ = "attachments"
+    __mapper_args__ = {"eager_defaults": True}
 
     id = Column(String(36), primary_key=True, default=lambda: str(uuid.uuid4()))
     message_id = Column(String(36), ForeignKey("messages.id", ondelete="CASCADE"), nullable=False)
@@ -56,20 +95,67 @@ class Attachment(Base):
     mime_type = Column(String(100), nullable=False)
     size = Column(String(20), nullable=False)  # Human-readable size
     size_bytes = Column(String(20), nullable=False)  # Actual size in bytes
-    created_at = Column(DateTime, default=datetime.utcnow)
+    created_at = Column(DateTime, default=utc_now(), server_default=utc_now())
 
     message = relationship("Message", back_populates="attachments")
 
 
 # Database engine and session
-engine = create_async_engine(DATABASE_URL, echo=False)
+engine = create_async_engine(
+    DATABASE_URL,
+    echo=False,
+    pool_size=DB_POOL_SIZE,
+    max_overflow=DB_MAX_OVERFLOW,
+    pool_timeout=DB_POOL_TIMEOUT_SECONDS,
+    pool_recycle=DB_POOL_RECYCLE_SECONDS,
+    pool_pre_ping=True,
+    connect_args={"check_same_thread": False}
+)
 async_session = async_sessionmaker(engine, class_=AsyncSession, expire_on_commit=False)
 
 
+@event.listens_for(engine.sync_engine, "connect")
+def _set_sqlite_pragmas(dbapi_connection, connection_record):
+    """
+    Enable WAL so readers don't block the writer; NORMAL sync is safe with WAL.
+    Foreign keys are off by default in SQLite and needed for ON DELETE CASCADE.
+    """
+    cursor = dbapi_connection.cursor()
+    cursor.execute("PRAGMA journal_mode=WAL")
+    cursor.execute("PRAGMA synchronous=NORMAL")
+    cursor.execute("PRAGMA foreign_keys=ON")
+    cursor.close()
+
+
+def _create_indexes(sync_conn):
+    """Create indexes missing from tables that existed before they were added."""
+    for table in Base.metadata.sorted_tables:
+        for index in table.indexes:
+            index.create(sync_conn, checkfirst=True)
+
+
+async def _backfill_timestamps(conn):
+    """
+    Fill NULL timestamps left in tables created before the column defaults
+    (create_all doesn't alter existing tables); the API requires them.
+    """
+    for model, columns in (
+        (Chat, (Chat.created_at, Chat.updated_at)),
+        (Message, (Message.created_at,)),
+        (Attachment, (Attachment.created_at,)),
+    ):
+        for column in columns:
+            await conn.execute(
+                update(model).where(column.is_(None)).values({column: utc_now()})
+            )
+
+
 async def init_db():
     """Initialize database tables."""
     async with engine.begin() as conn:
         await conn.run_sync(Base.metadata.create_all)
+        await conn.run_sync(_create_indexes)
+        await _backfill_timestamps(conn)
 
 
 async def get_session() -> AsyncSession:
@@ -77,3 +163,86 @@ async def get_session() -> AsyncSession:
     async with async_session() as session:
         yield session
 
+
+# Read cache for chat endpoints. Entries are never deleted on write: each key
+# embeds a version counter, and writes bump the counter so old keys simply expire.
+redis_client: Optional[Redis] = Redis.from_url(REDIS_URL) if REDIS_URL else None
+
+CHATS_LIST_VERSION_KEY = "chats:list:ver"
+
+
+def chat_version_key(chat_id: str) -> str:
+    return f"chat:{chat_id}:ver"
+
+
+async def cached_payload(
+    key_prefix: str,
+    version_key: str,
+    build: Callable[[], Awaitable[Any]]
+) -> bytes:
+    """
+    Return a payload as orjson-encoded bytes from Redis, building it on a miss.
+    
+    Only the request that wins the SET NX lock rebuilds a missing entry;
+    concurrent requests wait briefly for it before falling back to the DB.
+    """
+    if redis_client is None:
+        return orjson.dumps(await build())
+
+    lock_key = None
+    try:
+        try:
+            version = int(await redis_client.get(version_key) or 0)
+            key = f"{key_prefix}:v{version}"
+            cached = await redis_client.get(key)
+            if cached is None:
+                if await redis_client.set(f"{key}:lock", 1, nx=True, ex=CHAT_CACHE_REBUILD_LOCK_SECONDS):
+                    lock_key = f"{key}:lock"
+                else:
+                    for _ in range(10):
+                        await asyncio.sleep(0.05)
+                        cached = await redis_client.get(key)
+                        if cached is not None:
+                            break
+            if cached is not None:
+                return cached
+        except RedisError as e:
+            logger.warning("Redis read failed, using database: %s", e)
+            return orjson.dumps(await build())
+
+        payload = orjson.dumps(await build())
+        try:
+            await redis_client.set(key, payload, ex=CHAT_CACHE_TTL_SECONDS)
+        except RedisError as e:
+            logger.warning("Redis write failed: %s", e)
+        return payload
+    finally:
+        # Release the rebuild lock even if build() raised, so waiters stop polling
+        if lock_key is not None:
+            try:
+                await redis_client.delete(lock_key)
+            except RedisError as e:
+                logger.warning("Redis lock release failed: %s", e)
+
+
+async def invalidate_chat_cache(chat_id: Optional[str] = None):
+    """Bump cache versions after a chat write (the list always changes too)."""
+    if redis_client is None:
+        return
+
+    try:
+        async with redis_client.pipeline(transaction=False) as pipe:
+            pipe.incr(CHATS_LIST_VERSION_KEY)
+            if chat_id:
+                # Expire with the chat's last write so deleted chats leave nothing behind
+                pipe.incr(chat_version_key(chat_id))
+                pipe.expire(chat_version_key(chat_id), CHAT_VERSION_TTL_SECONDS)
+            await pipe.execute()
+    except RedisError as e:
+        logger.warning("Redis invalidation failed: %s", e)
+
+
+async def close_cache():
+    """Close the Redis connection pool on shutdown."""
+    if redis_client is not None:
+        await redis_client.aclose()
@@ -3,64 +3,140 @@ File text extraction for LLM context.
 Extracts text from various file formats to provide as context to the council.
 """
 import os
-from pathlib import Path
+import functools
+import multiprocessing
+from concurrent.futures import ThreadPoolExecutor, ProcessPoolExecutor
 from typing import Optional
 import asyncio
 
-from .config import MAX_CHARS_PER_FILE, MAX_TOTAL_CONTEXT_CHARS
+from .config import MAX_CHARS_PER_FILE, MAX_TOTAL_CONTEXT_CHARS, TEXT_EXTENSIONS
 
-# Text-based extensions that can be read directly
-TEXT_EXTENSIONS = {
-    ".txt", ".md", ".json", ".xml", ".csv", ".yaml", ".yml",
-    ".py", ".js", ".ts", ".jsx", ".tsx", ".html", ".css", ".scss",
-    ".java", ".c", ".cpp", ".h", ".hpp", ".cs", ".go", ".rs", ".rb",
-    ".php", ".sql", ".sh", ".bash", ".zsh", ".ps1",
-    ".ini", ".cfg", ".conf", ".env", ".toml",
-}
+# Worker threads for plain text files (file reads release the GIL)
+_EXTRACT_POOL = ThreadPoolExecutor(max_workers=8, thread_name_prefix="extract")
 
+# Worker processes, one document at a time each: python-docx and openpyxl hold
+# the GIL, and PDFium is not thread-safe even across separate documents
+_CPU_POOL = ProcessPoolExecutor(
+    max_workers=max(2, (os.cpu_count() or 2) // 2),
+    mp_context=multiprocessing.get_context("spawn")
+)
+CPU_BOUND_EXTENSIONS = frozenset({".pdf", ".docx", ".xlsx"})
 
+TRUNCATED_MARKER = "\n[... содержимое обрезано ...]"
+
+
+class CharsBudget:
+    """
+    Accumulates text chunks up to a character limit.
+    
+    The chunk that crosses the limit is cut at the limit and the
+    truncation marker is appended to it exactly once.
+    """
+
+    def __init__(self, limit: int, marker: str = TRUNCATED_MARKER):
+        self.limit = limit
+        self.marker = marker
+        self.used = 0
+        self.parts: list[str] = []
+        self.truncated = False
+
+    @property
+    def remaining(self) -> int:
+        """Characters left before the limit."""
+        return self.limit - self.used
+
+    def add(self, chunk: str) -> bool:
+        """Append a chunk. Returns False once the budget is exhausted."""
+        if self.truncated:
+            return False
+        if self.used + len(chunk) > self.limit:
+            self.parts.append(chunk[:self.remaining] + self.marker)
+            self.used = self.limit
+            self.truncated = True
+            return False
+        self.parts.append(chunk)
+        self.used += len(chunk)
+        return True
+
+    def text(self, separator: str = "\n") -> str:
+        """Join collected chunks."""
+        return separator.join(self.parts).strip()
+
+
+@functools.lru_cache(maxsize=1024)
 def get_file_extension(filename: str) -> str:
     """Get file extension in lowercase."""
-    return Path(filename).suffix.lower()
+    dot = filename.rfind(".")
+    return filename[dot:].lower() if dot != -1 else ""
 
 
 def extract_text_from_text_file(file_path: str, max_chars: int = MAX_CHARS_PER_FILE) -> str:
     """Extract text from a plain text file."""
     try:
-        with open(file_path, "r", encoding="utf-8", errors="replace") as f:
-            content = f.read(max_chars + 100)  # Read a bit extra to check if truncated
-            
-        if len(content) > max_chars:
-            content = content[:max_chars] + "\n[... содержимое обрезано ...]"
+        # UTF-8 is at most 4 bytes per char; read a bit extra to check if truncated
+        fd = os.open(file_path, os.O_RDONLY)
+        try:
+            data = os.read(fd, max_chars * 4 + 100)
+        finally:
+            os.close(fd)
         
-        return content.strip()
+        # Skip UTF-8 BOM without copying the buffer
+        view = memoryview(data)
+        if data[:3] == b"\xef\xbb\xbf":
+            view = view[3:]
+        # Same newlines as text-mode open(): CRLF and lone CR become LF
+        text = str(view, "utf-8", "replace").replace("\r\n", "\n").replace("\r", "\n")
+        budget = CharsBudget(max_chars)
+        budget.add(text)
+        return budget.text()
     except Exception as e:
         return f"[Ошибка чтения файла: {str(e)}]"
 
 
 def extract_text_from_pdf(file_path: str, max_chars: int = MAX_CHARS_PER_FILE) -> str:
+    """Extract text from a PDF file using pypdfium2 (falls back to pdfplumber)."""
+    try:
+        import pypdfium2 as pdfium
+    except ImportError:
+        return _extract_text_from_pdf_pdfplumber(file_path, max_chars)
+
+    try:
+        budget = CharsBudget(max_chars)
+        
+        pdf = pdfium.PdfDocument(file_path)
+        try:
+            for page in pdf:
+                textpage = page.get_textpage()
+                try:
+                    page_text = textpage.get_text_range().replace("\r\n", "\n")
+                finally:
+                    textpage.close()
+                    page.close()
+                if not budget.add(page_text):
+                    break
+        finally:
+            pdf.close()
+        
+        return budget.text()
+    except Exception as e:
+        return f"[Ошибка чтения PDF: {str(e)}]"
+
+
+def _extract_text_from_pdf_pdfplumber(file_path: str, max_chars: int = MAX_CHARS_PER_FILE) -> str:
     """Extract text from a PDF file using pdfplumber."""
     try:
         import pdfplumber
         
-        text_parts = []
-        total_chars = 0
+        budget = CharsBudget(max_chars)
         
         with pdfplumber.open(file_path) as pdf:
             for page in pdf.pages:
-                page_text = page.extract_text() or ""
-                if total_chars + len(page_text) > max_chars:
-                    # Truncate at limit
-                    remaining = max_chars - total_chars
-                    text_parts.append(page_text[:remaining])
-                    text_parts.append("\n[... содержимое обрезано ...]")
+                if not budget.add(page.extract_text() or ""):
                     break
-                text_parts.append(page_text)
-                total_chars += len(page_text)
         
-        return "\n".join(text_parts).strip()
+        return budget.text()
     except ImportError:
-        return "[PDF: библиотека pdfplumber не установлена]"
+        return "[PDF: библиотеки pypdfium2 и pdfplumber не установлены]"
     except Exception as e:
         return f"[Ошибка чтения PDF: {str(e)}]"
 
@@ -71,20 +147,13 @@ def extract_text_from_docx(file_path: str, max_chars: int = MAX_CHARS_PER_FILE)
         from docx import Document
         
         doc = Document(file_path)
-        text_parts = []
-        total_chars = 0
+        budget = CharsBudget(max_chars)
         
         for para in doc.paragraphs:
-            para_text = para.text
-            if total_chars + len(para_text) > max_chars:
-                remaining = max_chars - total_chars
-                text_parts.append(para_text[:remaining])
-                text_parts.append("\n[... содержимое обрезано ...]")
+            if not budget.add(para.text):
                 break
-            text_parts.append(para_text)
-            total_chars += len(para_text)
         
-        return "\n".join(text_parts).strip()
+        return budget.text()
     except ImportError:
         return "[DOCX: библиотека python-docx не установлена]"
     except Exception as e:
@@ -97,24 +166,21 @@ def extract_text_from_xlsx(file_path: str, max_chars: int = MAX_CHARS_PER_FILE)
         from openpyxl import load_workbook
         
         wb = load_workbook(file_path, read_only=True, data_only=True)
-        text_parts = []
-        total_chars = 0
-        
-        for sheet_name in wb.sheetnames:
-            sheet = wb[sheet_name]
-            text_parts.append(f"=== Лист: {sheet_name} ===")
-            
-            for row in sheet.iter_rows(values_only=True):
-                row_text = " | ".join(str(cell) if cell is not None else "" for cell in row)
-                if total_chars + len(row_text) > max_chars:
-                    text_parts.append("[... содержимое обрезано ...]")
-                    wb.close()
-                    return "\n".join(text_parts).strip()
-                text_parts.append(row_text)
-                total_chars += len(row_text) + 1
-        
-        wb.close()
-        return "\n".join(text_parts).strip()
+        budget = CharsBudget(max_chars)
+        
+        try:
+            for sheet_name in wb.sheetnames:
+                if not budget.add(f"=== Лист: {sheet_name} ==="):
+                    break
+                for row in wb[sheet_name].iter_rows(values_only=True):
+                    if not budget.add(" | ".join([("" if cell is None else str(cell)) for cell in row])):
+                        break
+                if budget.truncated:
+                    break
+        finally:
+            wb.close()
+        
+        return budget.text()
     except ImportError:
         return "[XLSX: библиотека openpyxl не установлена]"
     except Exception as e:
@@ -166,33 +232,36 @@ async def extract_text_from_files(files_info: list[dict]) -> str:
     if not files_info:
         return ""
     
-    lines = ["=== Вложения ==="]
-    total_chars = 0
+    # Extract all files concurrently, CPU-bound formats in worker processes
+    loop = asyncio.get_running_loop()
+    contents = await asyncio.gather(*(
+        loop.run_in_executor(
+            _CPU_POOL if get_file_extension(file_info["filename"]) in CPU_BOUND_EXTENSIONS else _EXTRACT_POOL,
+            extract_text_from_file,
+            file_info
+        )
+        for file_info in files_info
+    ))
+    
+    budget = CharsBudget(MAX_TOTAL_CONTEXT_CHARS, marker="\n[... остальные файлы опущены ...]")
     
-    for file_info in files_info:
+    for file_info, content in zip(files_info, contents):
         filename = file_info["filename"]
         
-        # Extract text (run in thread pool to avoid blocking)
-        loop = asyncio.get_event_loop()
-        content = await loop.run_in_executor(
-            None, extract_text_from_file, file_info
-        )
-        
         # Format file block
         file_block = f"\n[FILE: {filename}]\n{content}\n[/FILE]"
         
-        # Check total limit
-        if total_chars + len(file_block) > MAX_TOTAL_CONTEXT_CHARS:
-            remaining = MAX_TOTAL_CONTEXT_CHARS - total_chars
-            if remaining > 100:
-                file_block = file_block[:remaining] + "\n[... остальные файлы опущены ...]"
-                lines.append(file_block)
-            else:
-                lines.append(f"\n[FILE: {filename}]\n[... файл опущен из-за лимита символов ...]\n[/FILE]")
+        # Not worth including a few chars of the file - just mark it as omitted
+        if len(file_block) > budget.remaining and budget.remaining <= 100:
+            budget.parts.append(f"\n[FILE: {filename}]\n[... файл опущен из-за лимита символов ...]\n[/FILE]")
+            break
+        if not budget.add(file_block):
             break
-        
-        lines.append(file_block)
-        total_chars += len(file_block)
     
-    return "\n".join(lines)
+    return "\n".join(["=== Вложения ===", *budget.parts])
+
 
+def shutdown_extract_pools():
+    """Stop extraction worker threads and processes."""
+    _EXTRACT_POOL.shutdown(wait=False, cancel_futures=True)
+    _CPU_POOL.shutdown(wait=False, cancel_futures=True)
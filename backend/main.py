@@ -1,28 +1,32 @@
 """
 FastAPI application for LLM Council.
 """
-import json
-import asyncio
 import uuid
 import os
-from pathlib import Path
-from datetime import datetime
+import asyncio
+from datetime import datetime, timezone
 from typing import Optional
 from contextlib import asynccontextmanager
 
+import orjson
+from cachetools import TTLCache
 from fastapi import FastAPI, HTTPException, Depends, Query, UploadFile, File, Form
 from fastapi.middleware.cors import CORSMiddleware
-from fastapi.responses import StreamingResponse, FileResponse
-from sqlalchemy import select, desc
+from fastapi.responses import StreamingResponse, FileResponse, Response
+from sqlalchemy import select, desc, insert, update, delete
 from sqlalchemy.ext.asyncio import AsyncSession
-from sqlalchemy.orm import selectinload
+from sqlalchemy.orm import selectinload, load_only
 
 from .config import (
     COUNCIL_MODELS, CHAIRMAN_MODEL, UPLOADS_DIR,
     MAX_FILES_PER_MESSAGE, MAX_FILE_SIZE_BYTES, MAX_TOTAL_SIZE_BYTES,
-    ALLOWED_EXTENSIONS
+    ALLOWED_EXTENSIONS, DEFAULT_TITLES, CHAT_TITLE_MAX_CHARS, SSE_HEARTBEAT_SECONDS
+)
+from .database import (
+    init_db, get_session, async_session, utc_now, Chat, Message, Attachment,
+    cached_payload, invalidate_chat_cache, chat_version_key,
+    close_cache, CHATS_LIST_VERSION_KEY
 )
-from .database import init_db, get_session, async_session, Chat, Message, Attachment
 from .schemas import (
     ChatCreate,
     ChatResponse,
@@ -31,11 +35,10 @@ from .schemas import (
     MessageResponse,
     MessageRole,
     StageType,
-    StageProgressEvent,
-    AttachmentResponse,
 )
 from .council import orchestrator
-from .file_extractor import extract_text_from_files
+from .openrouter import client as openrouter_client
+from .file_extractor import extract_text_from_files, get_file_extension, shutdown_extract_pools
 
 
 @asynccontextmanager
@@ -43,6 +46,9 @@ async def lifespan(app: FastAPI):
     """Application lifespan handler."""
     await init_db()
     yield
+    shutdown_extract_pools()
+    await close_cache()
+    await openrouter_client.aclose()
 
 
 app = FastAPI(
@@ -62,6 +68,48 @@ app.add_middleware(
 )
 
 
+def _json(body: bytes) -> Response:
+    """
+    Send an already-encoded JSON body.
+    
+    Returning a Response skips FastAPI's response_model validation and
+    serialization; response_model is kept on the route for the OpenAPI docs.
+    """
+    return Response(content=body, media_type="application/json")
+
+
+def _sse(obj: dict) -> bytes:
+    """Frame an object as a Server-Sent Event."""
+    return b"data: " + orjson.dumps(obj) + b"\n\n"
+
+
+SSE_HEARTBEAT = b": keepalive\n\n"
+
+
+async def _with_heartbeats(events, interval: float):
+    """
+    Re-yield items from an async iterator, yielding None whenever it has been
+    silent for `interval` seconds. The pending item is awaited with
+    asyncio.wait, so a heartbeat never cancels the underlying iterator.
+    """
+    iterator = aiter(events)
+    pending = asyncio.ensure_future(anext(iterator))
+    try:
+        while True:
+            done, _ = await asyncio.wait({pending}, timeout=interval)
+            if not done:
+                yield None
+                continue
+            try:
+                item = pending.result()
+            except StopAsyncIteration:
+                return
+            yield item
+            pending = asyncio.ensure_future(anext(iterator))
+    finally:
+        pending.cancel()
+
+
 # Helper functions for file handling
 def format_file_size(size_bytes: int) -> str:
     """Format file size to human-readable format."""
@@ -73,11 +121,6 @@ def format_file_size(size_bytes: int) -> str:
         return f"{size_bytes / (1024 * 1024):.1f} MB"
 
 
-def get_file_extension(filename: str) -> str:
-    """Get file extension in lowercase."""
-    return Path(filename).suffix.lower()
-
-
 async def validate_and_save_files(
     files: list[UploadFile],
     chat_id: str,
@@ -143,11 +186,62 @@ async def validate_and_save_files(
     return saved_files
 
 
-# Health check
+async def get_chat_title_or_404(session: AsyncSession, chat_id: str) -> str:
+    """Fetch only the chat's title, raising 404 if the chat doesn't exist."""
+    title = await session.scalar(select(Chat.title).where(Chat.id == chat_id))
+    if title is None:
+        raise HTTPException(status_code=404, detail="Chat not found")
+    return title
+
+
+def title_from_message(content: str) -> str:
+    """Chat title made from the first message."""
+    if len(content) > CHAT_TITLE_MAX_CHARS:
+        return content[:CHAT_TITLE_MAX_CHARS] + "..."
+    return content
+
+
+async def save_user_turn(
+    session: AsyncSession,
+    chat_id: str,
+    user_row: dict,
+    attachment_rows: list[dict],
+    new_title: Optional[str] = None
+):
+    """Write a user message, its attachments and the chat title/timestamp in one commit."""
+    chat_values = {"updated_at": utc_now()}
+    if new_title:
+        chat_values["title"] = new_title
+
+    await session.execute(insert(Message), [user_row])
+    if attachment_rows:
+        await session.execute(insert(Attachment), attachment_rows)
+    await session.execute(update(Chat).where(Chat.id == chat_id).values(**chat_values))
+    await session.commit()
+    await invalidate_chat_cache(chat_id)
+
+
+async def save_council_answer(chat_id: str, assistant_row: dict):
+    """Write the council answer and bump the chat timestamp in one transaction."""
+    async with async_session() as session, session.begin():
+        await session.execute(insert(Message), [assistant_row])
+        await session.execute(
+            update(Chat).where(Chat.id == chat_id).values(updated_at=utc_now())
+        )
+    await invalidate_chat_cache(chat_id)
+
+
+# Health check. Probes hit it constantly, so the timestamp is refreshed once a second
+_health_timestamp = TTLCache(maxsize=1, ttl=1)
+
+
 @app.get("/health")
 async def health_check():
     """Health check endpoint."""
-    return {"status": "healthy", "timestamp": datetime.utcnow().isoformat()}
+    timestamp = _health_timestamp.get("now")
+    if timestamp is None:
+        timestamp = _health_timestamp["now"] = datetime.now(timezone.utc).isoformat()
+    return {"status": "healthy", "timestamp": timestamp}
 
 
 # Models info
@@ -173,6 +267,7 @@ async def create_chat(
     session.add(chat)
     await session.commit()
     await session.refresh(chat)
+    await invalidate_chat_cache()
     return chat
 
 
@@ -183,13 +278,20 @@ async def list_chats(
     session: AsyncSession = Depends(get_session)
 ):
     """List all chats, ordered by most recent."""
-    result = await session.execute(
-        select(Chat)
-        .order_by(desc(Chat.updated_at))
-        .limit(limit)
-        .offset(offset)
-    )
-    return result.scalars().all()
+    async def build():
+        result = await session.execute(
+            select(Chat)
+            .options(load_only(Chat.id, Chat.title, Chat.created_at, Chat.updated_at))
+            .order_by(desc(Chat.updated_at))
+            .limit(limit)
+            .offset(offset)
+        )
+        return [
+            ChatResponse.model_validate(chat).model_dump(mode="json")
+            for chat in result.scalars().all()
+        ]
+
+    return _json(await cached_payload(f"chats:list:{offset}:{limit}", CHATS_LIST_VERSION_KEY, build))
 
 
 @app.get("/api/chats/{chat_id}", response_model=ChatDetailResponse)
@@ -198,61 +300,58 @@ async def get_chat(
     session: AsyncSession = Depends(get_session)
 ):
     """Get a chat with all messages."""
-    result = await session.execute(
-        select(Chat).where(Chat.id == chat_id)
-    )
-    chat = result.scalar_one_or_none()
-    if not chat:
-        raise HTTPException(status_code=404, detail="Chat not found")
-
-    # Get messages with attachments
-    msg_result = await session.execute(
-        select(Message)
-        .options(selectinload(Message.attachments))
-        .where(Message.chat_id == chat_id)
-        .order_by(Message.created_at)
-    )
-    messages = msg_result.scalars().all()
-
-    # Convert to response format
-    msg_responses = []
-    for msg in messages:
-        # Convert attachments
-        attachments = [
-            AttachmentResponse(
-                id=att.id,
-                filename=att.filename,
-                mime_type=att.mime_type,
-                size=att.size
-            )
-            for att in msg.attachments
-        ]
-        
-        msg_resp = MessageResponse(
-            id=msg.id,
-            chat_id=msg.chat_id,
-            role=msg.role,
-            content=msg.content,
-            created_at=msg.created_at,
-            attachments=attachments,
+    async def build():
+        # Chat, its messages (ordered by the relationship) and their attachments in one statement
+        result = await session.execute(
+            select(Chat)
+            .where(Chat.id == chat_id)
+            .options(selectinload(Chat.messages).selectinload(Message.attachments))
         )
-        if msg.discussion_data:
-            data = msg.discussion_data
-            msg_resp.stage = StageType.CONSENSUS
-            msg_resp.initial_responses = data.get("initial_responses")
-            msg_resp.discussion_rounds = data.get("discussion_rounds")
-            if "consensus" in data:
-                from .schemas import ConsensusResponse
-                msg_resp.consensus = ConsensusResponse(**data["consensus"])
-        msg_responses.append(msg_resp)
-
-    return ChatDetailResponse(
-        id=chat.id,
-        title=chat.title,
-        created_at=chat.created_at,
-        updated_at=chat.updated_at,
-        messages=msg_responses
-    )
+        chat = result.scalar_one_or_none()
+        if not chat:
+            raise HTTPException(status_code=404, detail="Chat not found")
+
+        # Rows were validated on the write path, so build the payload directly
+        # instead of re-validating every message through Pydantic
+        messages = []
+        for msg in chat.messages:
+            msg_data = {
+                "id": msg.id,
+                "chat_id": msg.chat_id,
+                "role": msg.role.value,
+                "content": msg.content,
+                "created_at": msg.created_at,
+                "attachments": [
+                    {
+                        "id": att.id,
+                        "filename": att.filename,
+                        "mime_type": att.mime_type,
+                        "size": att.size
+                    }
+                    for att in msg.attachments
+                ],
+                "stage": None,
+                "initial_responses": None,
+                "discussion_rounds": None,
+                "consensus": None,
+            }
+            if msg.discussion_data:
+                data = msg.discussion_data
+                msg_data["stage"] = StageType.CONSENSUS.value
+                msg_data["initial_responses"] = data.get("initial_responses")
+                msg_data["discussion_rounds"] = data.get("discussion_rounds")
+                msg_data["consensus"] = data.get("consensus")
+            messages.append(msg_data)
+
+        return {
+            "id": chat.id,
+            "title": chat.title,
+            "created_at": chat.created_at,
+            "updated_at": chat.updated_at,
+            "messages": messages
+        }
+
+    return _json(await cached_payload(f"chat:{chat_id}", chat_version_key(chat_id), build))
 
 
 @app.delete("/api/chats/{chat_id}")
@@ -261,15 +360,12 @@ async def delete_chat(
     session: AsyncSession = Depends(get_session)
 ):
     """Delete a chat and all its messages."""
-    result = await session.execute(
-        select(Chat).where(Chat.id == chat_id)
-    )
-    chat = result.scalar_one_or_none()
-    if not chat:
+    # Messages and attachments go with it via ON DELETE CASCADE
+    result = await session.execute(delete(Chat).where(Chat.id == chat_id))
+    if result.rowcount == 0:
         raise HTTPException(status_code=404, detail="Chat not found")
-
-    await session.delete(chat)
     await session.commit()
+    await invalidate_chat_cache(chat_id)
     return {"status": "deleted", "chat_id": chat_id}
 
 
@@ -280,18 +376,21 @@ async def update_chat(
     session: AsyncSession = Depends(get_session)
 ):
     """Update chat title."""
+    values = {"updated_at": utc_now()}
+    if chat_data.title:
+        values["title"] = chat_data.title
+
     result = await session.execute(
-        select(Chat).where(Chat.id == chat_id)
+        update(Chat)
+        .where(Chat.id == chat_id)
+        .values(**values)
+        .returning(Chat.id, Chat.title, Chat.created_at, Chat.updated_at)
     )
-    chat = result.scalar_one_or_none()
+    chat = result.one_or_none()
     if not chat:
         raise HTTPException(status_code=404, detail="Chat not found")
-
-    if chat_data.title:
-        chat.title = chat_data.title
-    chat.updated_at = datetime.utcnow()
     await session.commit()
-    await session.refresh(chat)
+    await invalidate_chat_cache(chat_id)
     return ChatResponse(
         id=chat.id,
         title=chat.title,
@@ -335,19 +434,16 @@ async def send_message_stream(
     chat_id: str,
     content: str = Form(...),
     files: list[UploadFile] = File(default=[]),
+    force_refresh: bool = Form(False),
     session: AsyncSession = Depends(get_session)
 ):
     """
     Send a message with optional file attachments and stream the council discussion response.
-    Returns Server-Sent Events (SSE).
+    Returns Server-Sent Events (SSE). Set force_refresh to bypass the
+    council result cache.
     """
     # Verify chat exists
-    result = await session.execute(
-        select(Chat).where(Chat.id == chat_id)
-    )
-    chat = result.scalar_one_or_none()
-    if not chat:
-        raise HTTPException(status_code=404, detail="Chat not found")
+    title = await get_chat_title_or_404(session, chat_id)
 
     # Create message ID first for file storage
     message_id = str(uuid.uuid4())
@@ -360,120 +456,94 @@ async def send_message_stream(
         # Extract text from files for context
         files_context = await extract_text_from_files(saved_files)
 
-    # Save user message
-    user_message = Message(
-        id=message_id,
-        chat_id=chat_id,
-        role=MessageRole.USER,
-        content=content
-    )
-    session.add(user_message)
-    await session.flush()
-    
-    # Save attachments
-    for file_info in saved_files:
-        attachment = Attachment(
-            message_id=message_id,
-            filename=file_info["filename"],
-            stored_filename=file_info["stored_filename"],
-            mime_type=file_info["mime_type"],
-            size=file_info["size"],
-            size_bytes=file_info["size_bytes"]
-        )
-        session.add(attachment)
-    
-    await session.commit()
+    user_row = {
+        "id": message_id,
+        "chat_id": chat_id,
+        "role": MessageRole.USER,
+        "content": content,
+    }
+    attachment_rows = [
+        {
+            "message_id": message_id,
+            "filename": file_info["filename"],
+            "stored_filename": file_info["stored_filename"],
+            "mime_type": file_info["mime_type"],
+            "size": file_info["size"],
+            "size_bytes": file_info["size_bytes"],
+        }
+        for file_info in saved_files
+    ]
 
-    # Update chat title if it's the first message
-    if chat.title in ("New Chat", "Новый чат"):
-        # Use first 50 chars of message as title
-        chat.title = content[:50] + ("..." if len(content) > 50 else "")
-        await session.commit()
+    # First message becomes the chat title
+    new_title = title_from_message(content) if title in DEFAULT_TITLES else None
 
-    # Load chat history for context (last 10 messages)
+    # Load chat history for context (last 10 messages). Only role and content
+    # are selected, so the large discussion_data JSON is never read
     history_result = await session.execute(
-        select(Message)
+        select(Message.role, Message.content)
         .where(Message.chat_id == chat_id)
-        .where(Message.id != user_message.id)  # Exclude just-added message
         .order_by(Message.created_at.desc())
         .limit(10)
     )
-    previous_messages = list(reversed(history_result.scalars().all()))
-    chat_history = [{"role": m.role.value, "content": m.content} for m in previous_messages]
+    chat_history = [
+        {"role": role.value, "content": text} for role, text in history_result.all()
+    ][::-1]
 
-    async def event_generator():
-        """Generate SSE events for the council discussion."""
-        progress_events = []
-
-        async def on_progress(event: StageProgressEvent):
-            progress_events.append(event)
-            yield f"data: {json.dumps({'type': 'progress', 'data': event.model_dump()})}\n\n"
+    # Save the user turn before the council runs, so it survives a failed run,
+    # a client disconnect or a worker restart
+    await save_user_turn(session, chat_id, user_row, attachment_rows, new_title)
 
-        # Create a queue for progress events
-        progress_queue = asyncio.Queue()
+    # Return the connection to the pool for the minutes-long council run,
+    # the final write below opens its own session
+    await session.close()
 
-        async def progress_callback(event: StageProgressEvent):
-            await progress_queue.put(event)
-
-        # Start council discussion
+    async def event_generator():
+        """Generate SSE events for the council discussion."""
         try:
-            # Run council in background task with chat history and files context
-            council_task = asyncio.create_task(
-                orchestrator.run_full_council(content, chat_history, progress_callback, files_context)
+            council_events = orchestrator.run_full_council_stream(
+                content, chat_history, files_context,
+                force_refresh=force_refresh, chat_id=chat_id
             )
-
-            # Stream progress events
-            while not council_task.done():
-                try:
-                    event = await asyncio.wait_for(progress_queue.get(), timeout=0.5)
-                    yield f"data: {json.dumps({'type': 'progress', 'data': event.model_dump()})}\n\n"
-                except asyncio.TimeoutError:
+            async for event in _with_heartbeats(council_events, SSE_HEARTBEAT_SECONDS):
+                if event is None:
+                    yield SSE_HEARTBEAT
                     continue
-
-            # Get final result
-            result = await council_task
-
-            # Drain remaining progress events
-            while not progress_queue.empty():
-                event = await progress_queue.get()
-                yield f"data: {json.dumps({'type': 'progress', 'data': event.model_dump()})}\n\n"
+                kind, payload = event
+                if kind == "progress":
+                    yield _sse({'type': 'progress', 'data': payload.model_dump()})
+                else:
+                    result = payload
+
+            # Dump once: the same dicts are streamed and stored as discussion_data
+            discussion_data = {
+                "initial_responses": [r.model_dump() for r in result['initial_responses']],
+                "discussion_rounds": [r.model_dump() for r in result['discussion_rounds']],
+                "consensus": result['consensus'].model_dump()
+            }
 
             # Send initial responses
-            yield f"data: {json.dumps({'type': 'initial_responses', 'data': [r.model_dump() for r in result['initial_responses']]})}\n\n"
+            yield _sse({'type': 'initial_responses', 'data': discussion_data['initial_responses']})
 
             # Send discussion rounds
-            for round_data in result['discussion_rounds']:
-                yield f"data: {json.dumps({'type': 'discussion_round', 'data': round_data.model_dump()})}\n\n"
+            for round_data in discussion_data['discussion_rounds']:
+                yield _sse({'type': 'discussion_round', 'data': round_data})
 
             # Send consensus
-            yield f"data: {json.dumps({'type': 'consensus', 'data': result['consensus'].model_dump()})}\n\n"
-
-            # Save assistant message
-            async with async_session() as new_session:
-                assistant_message = Message(
-                    chat_id=chat_id,
-                    role=MessageRole.ASSISTANT,
-                    content=result['consensus'].final_answer,
-                    discussion_data={
-                        "initial_responses": [r.model_dump() for r in result['initial_responses']],
-                        "discussion_rounds": [r.model_dump() for r in result['discussion_rounds']],
-                        "consensus": result['consensus'].model_dump()
-                    }
-                )
-                new_session.add(assistant_message)
-                
-                # Update chat timestamp
-                chat_result = await new_session.execute(
-                    select(Chat).where(Chat.id == chat_id)
-                )
-                chat_obj = chat_result.scalar_one()
-                chat_obj.updated_at = datetime.utcnow()
-                await new_session.commit()
-
-                yield f"data: {json.dumps({'type': 'done', 'data': {'message_id': assistant_message.id}})}\n\n"
+            yield _sse({'type': 'consensus', 'data': discussion_data['consensus']})
+
+            assistant_row = {
+                "id": str(uuid.uuid4()),
+                "chat_id": chat_id,
+                "role": MessageRole.ASSISTANT,
+                "content": result['consensus'].final_answer,
+                "discussion_data": discussion_data,
+            }
+            await save_council_answer(chat_id, assistant_row)
+
+            yield _sse({'type': 'done', 'data': {'message_id': assistant_row['id']}})
 
         except Exception as e:
-            yield f"data: {json.dumps({'type': 'error', 'data': {'message': str(e)}})}\n\n"
+            yield _sse({'type': 'error', 'data': {'message': str(e)}})
 
     return StreamingResponse(
         event_generator(),
@@ -496,12 +566,7 @@ async def send_message(
     Send a message and get the council discussion response (non-streaming).
     """
     # Verify chat exists
-    result = await session.execute(
-        select(Chat).where(Chat.id == chat_id)
-    )
-    chat = result.scalar_one_or_none()
-    if not chat:
-        raise HTTPException(status_code=404, detail="Chat not found")
+    title = await get_chat_title_or_404(session, chat_id)
 
     # Save user message
     user_message = Message(
@@ -511,14 +576,15 @@ async def send_message(
     )
     session.add(user_message)
     await session.commit()
+    await invalidate_chat_cache(chat_id)
 
-    # Update chat title if it's the first message
-    if chat.title == "New Chat":
-        chat.title = message_data.content[:50] + ("..." if len(message_data.content) > 50 else "")
-        await session.commit()
+    # First message becomes the chat title, written with the answer below
+    needs_title = title in DEFAULT_TITLES
 
     # Run council discussion
-    council_result = await orchestrator.run_full_council(message_data.content)
+    council_result = await orchestrator.run_full_council(
+        message_data.content, force_refresh=message_data.force_refresh, chat_id=chat_id
+    )
 
     # Save assistant message
     assistant_message = Message(
@@ -532,9 +598,13 @@ async def send_message(
         }
     )
     session.add(assistant_message)
-    chat.updated_at = datetime.utcnow()
+    chat_values = {"updated_at": utc_now()}
+    if needs_title:
+        chat_values["title"] = title_from_message(message_data.content)
+    await session.execute(update(Chat).where(Chat.id == chat_id).values(**chat_values))
     await session.commit()
     await session.refresh(assistant_message)
+    await invalidate_chat_cache(chat_id)
 
     return MessageResponse(
         id=assistant_message.id,
@@ -551,5 +621,14 @@ async def send_message(
 
 if __name__ == "__main__":
     import uvicorn
-    uvicorn.run(app, host="0.0.0.0", port=8000)
+    # Workers need an import string; uvloop/httptools replace the pure-Python loop and parser
+    uvicorn.run(
+        "backend.main:app",
+        host="0.0.0.0",
+        port=8000,
+        loop="uvloop",
+        http="httptools",
+        workers=int(os.getenv("WORKERS", "1")),
+        log_level="warning"
+    )
 
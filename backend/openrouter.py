@@ -1,13 +1,101 @@
 """
 OpenRouter API client with async support and structured output.
 """
-import json
+import random
 import asyncio
 from typing import AsyncGenerator, Optional, Type
 import httpx
+import orjson
 from pydantic import BaseModel
 
-from .config import OPENROUTER_API_KEY, OPENROUTER_BASE_URL
+from .config import (
+    OPENROUTER_API_KEY, OPENROUTER_BASE_URL, COUNCIL_MODELS,
+    DEFAULT_MAX_PARALLEL_PER_MODEL, MAX_RETRIES, RETRY_BASE_DELAY_SECONDS,
+    HTTP_MAX_CONNECTIONS, HTTP_MAX_KEEPALIVE_CONNECTIONS
+)
+
+# Per-model concurrency limits, created lazily and keyed by model ID
+_MODEL_SEMAPHORES: dict[str, asyncio.Semaphore] = {}
+
+
+def _model_semaphore(model_id: str) -> asyncio.Semaphore:
+    """Get the semaphore limiting concurrent requests to a model."""
+    semaphore = _MODEL_SEMAPHORES.get(model_id)
+    if semaphore is None:
+        max_parallel = next(
+            (m.get("max_parallel", DEFAULT_MAX_PARALLEL_PER_MODEL) for m in COUNCIL_MODELS if m["id"] == model_id),
+            DEFAULT_MAX_PARALLEL_PER_MODEL
+        )
+        semaphore = _MODEL_SEMAPHORES[model_id] = asyncio.Semaphore(max_parallel)
+    return semaphore
+
+
+# Structured-output envelopes, built once per response_format class
+_RESPONSE_FORMATS: dict[type[BaseModel], dict] = {}
+
+
+def _response_format(model_cls: type[BaseModel]) -> dict:
+    """
+    Get the json_schema response_format for a Pydantic model.
+    
+    model_json_schema() walks the whole model on every call, so the result
+    is cached; the returned dict is shared and must not be mutated.
+    """
+    response_format = _RESPONSE_FORMATS.get(model_cls)
+    if response_format is None:
+        response_format = _RESPONSE_FORMATS[model_cls] = {
+            "type": "json_schema",
+            "json_schema": {
+                "name": model_cls.__name__,
+                "strict": True,
+                "schema": model_cls.model_json_schema()
+            }
+        }
+    return response_format
+
+
+async def _sse_events(byte_stream: AsyncGenerator[bytes, None]) -> AsyncGenerator[bytes, None]:
+    """
+    Split a server-sent events byte stream into events.
+    
+    Line endings (CRLF, CR or LF) are normalized to LF, and a final event
+    without a trailing blank line is still delivered at end of stream.
+    """
+    buffer = bytearray()
+    pending_cr = False
+    async for raw in byte_stream:
+        # A CRLF may be split across chunks; hold a trailing CR back
+        if pending_cr:
+            raw = b"\r" + raw
+        pending_cr = raw.endswith(b"\r")
+        if pending_cr:
+            raw = raw[:-1]
+        buffer += raw.replace(b"\r\n", b"\n").replace(b"\r", b"\n")
+        while (end := buffer.find(b"\n\n")) != -1:
+            yield bytes(buffer[:end])
+            del buffer[:end + 2]
+    if buffer.strip():
+        yield bytes(buffer)
+
+
+class ModelError:
+    """A model's request failed; returned in place of its response text."""
+
+    def __init__(self, model: str, message: str):
+        self.model = model
+        self.message = message
+
+    def __str__(self) -> str:
+        return self.message
+
+    def __repr__(self) -> str:
+        return f"ModelError({self.model!r}, {self.message!r})"
+
+
+def _is_retryable(error: httpx.HTTPStatusError) -> bool:
+    """Rate limits and server errors are worth retrying."""
+    status = error.response.status_code
+    return status == 429 or status >= 500
 
 
 class OpenRouterClient:
@@ -22,6 +110,21 @@ class OpenRouterClient:
             "HTTP-Referer": "http://localhost:5173",
             "X-Title": "LLM Council"
         }
+        # One pooled HTTP/2 connection is shared by all requests, so parallel
+        # completions multiplex over it instead of each doing a TLS handshake
+        self._client = httpx.AsyncClient(
+            http2=True,
+            timeout=httpx.Timeout(120.0, connect=10.0),
+            limits=httpx.Limits(
+                max_connections=HTTP_MAX_CONNECTIONS,
+                max_keepalive_connections=HTTP_MAX_KEEPALIVE_CONNECTIONS
+            ),
+            headers=self.headers
+        )
+
+    async def aclose(self):
+        """Close pooled connections on shutdown."""
+        await self._client.aclose()
 
     async def chat_completion(
         self,
@@ -53,24 +156,15 @@ class OpenRouterClient:
 
         # Add JSON schema for structured output if provided
         if response_format is not None:
-            payload["response_format"] = {
-                "type": "json_schema",
-                "json_schema": {
-                    "name": response_format.__name__,
-                    "strict": True,
-                    "schema": response_format.model_json_schema()
-                }
-            }
+            payload["response_format"] = _response_format(response_format)
 
-        async with httpx.AsyncClient(timeout=120.0) as client:
-            response = await client.post(
-                f"{self.base_url}/chat/completions",
-                headers=self.headers,
-                json=payload
-            )
-            response.raise_for_status()
-            data = response.json()
-            return data["choices"][0]["message"]["content"]
+        response = await self._client.post(
+            f"{self.base_url}/chat/completions",
+            json=payload
+        )
+        response.raise_for_status()
+        data = response.json()
+        return data["choices"][0]["message"]["content"]
 
     async def chat_completion_stream(
         self,
@@ -99,35 +193,66 @@ class OpenRouterClient:
             "stream": True,
         }
 
-        async with httpx.AsyncClient(timeout=120.0) as client:
-            async with client.stream(
-                "POST",
-                f"{self.base_url}/chat/completions",
-                headers=self.headers,
-                json=payload
-            ) as response:
-                response.raise_for_status()
-                async for line in response.aiter_lines():
-                    if line.startswith("data: "):
-                        data = line[6:]
-                        if data == "[DONE]":
-                            break
-                        try:
-                            chunk = json.loads(data)
-                            if "choices" in chunk and chunk["choices"]:
-                                delta = chunk["choices"][0].get("delta", {})
-                                if "content" in delta:
-                                    yield delta["content"]
-                        except json.JSONDecodeError:
-                            continue
+        async with self._client.stream(
+            "POST",
+            f"{self.base_url}/chat/completions",
+            json=payload
+        ) as response:
+            response.raise_for_status()
+            # Parse raw bytes: each data payload is decoded once by orjson
+            # without a str round trip
+            async for event in _sse_events(response.aiter_bytes()):
+                for line in event.split(b"\n"):
+                    if not line.startswith(b"data: "):
+                        continue  # ": keep-alive" comments and other fields
+                    data = line[6:]
+                    if data == b"[DONE]":
+                        return
+                    try:
+                        chunk = orjson.loads(data)
+                    except orjson.JSONDecodeError:
+                        continue
+                    if chunk.get("choices"):
+                        delta = chunk["choices"][0].get("delta", {})
+                        if "content" in delta:
+                            yield delta["content"]
+
+    async def stream_with_retry(self, req: dict) -> AsyncGenerator[str, None]:
+        """
+        Stream a single request under its model's concurrency limit.
+        
+        If the stream fails with a retryable error before any text has
+        arrived, falls back to the non-streaming retry loop and yields its
+        answer as one chunk.
+        """
+        started = False
+        try:
+            async with _model_semaphore(req["model"]):
+                async for chunk in self.chat_completion_stream(
+                    model=req["model"],
+                    messages=req["messages"],
+                    temperature=req.get("temperature", 0.7),
+                    max_tokens=req.get("max_tokens", 2048),
+                ):
+                    started = True
+                    yield chunk
+            return
+        except httpx.HTTPStatusError as e:
+            if started or not _is_retryable(e):
+                raise
+        yield await self._completion_with_retry(req)
 
     async def parallel_completions(
         self,
         requests: list[dict],
-    ) -> list[str]:
+    ) -> list[str | ModelError]:
         """
         Execute multiple chat completions in parallel.
         
+        A model that fails over HTTP (after retries) or returns a malformed reply
+        yields a ModelError so the other answers are kept; any other exception cancels the remaining
+        requests and propagates.
+        
         Args:
             requests: List of request dicts, each containing:
                 - model: str
@@ -137,19 +262,45 @@ class OpenRouterClient:
                 - response_format: Type[BaseModel] (optional)
                 
         Returns:
-            List of response strings in the same order as requests
+            List of response strings (or ModelError) in the same order as requests
+        """
+        try:
+            async with asyncio.TaskGroup() as tg:
+                tasks = [tg.create_task(self._completion_or_error(req)) for req in requests]
+        except* Exception as eg:
+            # Callers handle the original error, not TaskGroup's wrapper
+            raise eg.exceptions[0] from None
+        return [task.result() for task in tasks]
+
+    async def _completion_or_error(self, req: dict) -> str | ModelError:
+        """Run a request, turning HTTP failures and malformed replies into a ModelError."""
+        try:
+            return await self._completion_with_retry(req)
+        except (httpx.HTTPError, KeyError, IndexError, ValueError) as e:
+            return ModelError(req["model"], str(e) or type(e).__name__)
+
+    async def _completion_with_retry(self, req: dict) -> str:
+        """
+        Run a single request under its model's concurrency limit.
+        
+        HTTP 429 and 5xx responses are retried with exponential backoff
+        (1s, 2s, 4s plus jitter); the semaphore is released while waiting.
         """
-        tasks = [
-            self.chat_completion(
-                model=req["model"],
-                messages=req["messages"],
-                temperature=req.get("temperature", 0.7),
-                max_tokens=req.get("max_tokens", 2048),
-                response_format=req.get("response_format"),
-            )
-            for req in requests
-        ]
-        return await asyncio.gather(*tasks, return_exceptions=True)
+        for attempt in range(MAX_RETRIES + 1):
+            try:
+                async with _model_semaphore(req["model"]):
+                    return await self.chat_completion(
+                        model=req["model"],
+                        messages=req["messages"],
+                        temperature=req.get("temperature", 0.7),
+                        max_tokens=req.get("max_tokens", 2048),
+                        response_format=req.get("response_format"),
+                    )
+            except httpx.HTTPStatusError as e:
+                if attempt == MAX_RETRIES or not _is_retryable(e):
+                    raise
+            delay = RETRY_BASE_DELAY_SECONDS * 2 ** attempt
+            await asyncio.sleep(delay + random.uniform(0, delay / 2))
 
 
 # Global client instance
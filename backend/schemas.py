@@ -3,7 +3,7 @@ Pydantic schemas for request/response validation and structured LLM output.
 """
 from datetime import datetime
 from typing import Optional
-from pydantic import BaseModel, Field
+from pydantic import BaseModel, Field, field_validator
 from enum import Enum
 
 
@@ -84,6 +84,7 @@ class ChatResponse(BaseModel):
 class MessageCreate(BaseModel):
     """Request to send a message."""
     content: str
+    force_refresh: bool = False  # Bypass the council result cache
 
 
 class AttachmentResponse(BaseModel):
@@ -108,12 +109,24 @@ class ModelMessageResponse(BaseModel):
     stage: StageType
     round_number: int
 
+    class Config:
+        frozen = True
+
+    @field_validator("confidence")
+    @classmethod
+    def quantize_confidence(cls, value: float) -> float:
+        """Keep confidence at percent precision."""
+        return round(value, 2)
+
 
 class DiscussionRound(BaseModel):
     """A single round of discussion."""
     round_number: int
     responses: list[ModelMessageResponse]
 
+    class Config:
+        frozen = True
+
 
 class MessageResponse(BaseModel):
     """Full message response including discussion details."""
@@ -160,7 +173,8 @@ class StageProgressEvent(BaseModel):
     stage: StageType
     round_number: Optional[int] = None
     model_name: Optional[str] = None
-    status: str  # "started", "completed", "error"
+    status: str  # "started", "streaming", "completed", "error"
+    partial_content: Optional[str] = None  # Next chunk of text while "streaming"
 
 
 class StreamChunkEvent(BaseModel):
@@ -3,12 +3,14 @@ Pytest configuration and fixtures.
 """
 import os
 import sys
-import asyncio
 from pathlib import Path
 
 import pytest
+from unittest.mock import AsyncMock
 from httpx import AsyncClient, ASGITransport
+from sqlalchemy import event
 from sqlalchemy.ext.asyncio import create_async_engine, AsyncSession, async_sessionmaker
+from sqlalchemy.pool import StaticPool
 
 # Add backend to path
 sys.path.insert(0, str(Path(__file__).parent.parent.parent))
@@ -17,61 +19,114 @@ sys.path.insert(0, str(Path(__file__).parent.parent.parent))
 os.environ["DATA_DIR"] = "./test_data"
 os.environ["OPENROUTER_API_KEY"] = "test-key"
 
+from backend import main
 from backend.main import app
 from backend.database import Base, get_session
+from backend.schemas import ModelResponse, ConsensusResponse
 
 
-# Create test database
-TEST_DATABASE_URL = "sqlite+aiosqlite:///./test_data/test.db"
-test_engine = create_async_engine(TEST_DATABASE_URL, echo=False)
-test_async_session = async_sessionmaker(test_engine, class_=AsyncSession, expire_on_commit=False)
+# In-memory test database; StaticPool keeps the single connection (and the data) alive
+TEST_DATABASE_URL = "sqlite+aiosqlite:///:memory:"
+test_engine = create_async_engine(
+    TEST_DATABASE_URL,
+    echo=False,
+    poolclass=StaticPool,
+    connect_args={"check_same_thread": False}
+)
 
 
-async def override_get_session():
-    """Override database session for testing."""
-    async with test_async_session() as session:
-        yield session
+# pysqlite's own transaction handling breaks SAVEPOINT; emit BEGIN ourselves
+@event.listens_for(test_engine.sync_engine, "connect")
+def _disable_pysqlite_transactions(dbapi_connection, connection_record):
+    dbapi_connection.isolation_level = None
+
+
+@event.listens_for(test_engine.sync_engine, "begin")
+def _begin_transaction(conn):
+    conn.exec_driver_sql("BEGIN")
 
 
 @pytest.fixture(scope="session")
-def event_loop():
-    """Create event loop for async tests."""
-    loop = asyncio.get_event_loop_policy().new_event_loop()
-    yield loop
-    loop.close()
-
-
-@pytest.fixture(autouse=True)
-async def setup_database():
-    """Setup test database before each test."""
-    # Create test data directory
-    Path("./test_data").mkdir(exist_ok=True)
-    
-    # Create tables
+async def create_tables():
+    """Create tables once, on first use by a database test."""
     async with test_engine.begin() as conn:
         await conn.run_sync(Base.metadata.create_all)
-    
-    # Override dependency
-    app.dependency_overrides[get_session] = override_get_session
-    
     yield
+    await test_engine.dispose()
+
+
+@pytest.fixture
+async def test_async_session(create_tables, monkeypatch):
+    """
+    Run each test inside a transaction that is rolled back afterwards.
     
-    # Cleanup
-    async with test_engine.begin() as conn:
-        await conn.run_sync(Base.metadata.drop_all)
+    Sessions join it through SAVEPOINTs, so the commits made by the app
+    only release a savepoint and nothing outlives the test.
+    """
+    async with test_engine.connect() as conn:
+        transaction = await conn.begin()
+        session_factory = async_sessionmaker(
+            bind=conn,
+            class_=AsyncSession,
+            expire_on_commit=False,
+            join_transaction_mode="create_savepoint"
+        )
+
+        async def override_get_session():
+            async with session_factory() as session:
+                yield session
+
+        app.dependency_overrides[get_session] = override_get_session
+        # Endpoints that open their own session (streamed turn saves)
+        monkeypatch.setattr(main, "async_session", session_factory)
+
+        yield session_factory
+
+        await transaction.rollback()
 
 
 @pytest.fixture
-async def client():
-    """Create async test client."""
+async def client(test_async_session):
+    """Create async test client backed by the test database."""
     transport = ASGITransport(app=app)
     async with AsyncClient(transport=transport, base_url="http://test") as client:
         yield client
 
 
 @pytest.fixture
-async def db_session():
+async def db_session(test_async_session):
     """Get database session for tests."""
     async with test_async_session() as session:
         yield session
 
+
+@pytest.fixture
+def mock_parallel_completions(monkeypatch):
+    """Replace OpenRouter fan-out calls from the council with an AsyncMock."""
+    mock = AsyncMock(return_value=["R1", "R2", "R3"])
+    monkeypatch.setattr("backend.council.client.parallel_completions", mock)
+    return mock
+
+
+@pytest.fixture(scope="session")
+def sample_model_response():
+    """Validated ModelResponse shared by read-only tests."""
+    return ModelResponse(
+        content="This is a test response",
+        confidence=0.85,
+        agrees_with=["Model A", "Model B"],
+        key_points=["Point 1", "Point 2"],
+        disagreements=[]
+    )
+
+
+@pytest.fixture(scope="session")
+def sample_consensus_response():
+    """Validated ConsensusResponse shared by read-only tests."""
+    return ConsensusResponse(
+        final_answer="The consensus answer",
+        consensus_reached=True,
+        summary="All models agreed",
+        key_agreements=["Point 1"],
+        key_disagreements=[]
+    )
@@ -1,11 +1,9 @@
 """
 API endpoint tests.
 """
-import pytest
 from httpx import AsyncClient
 
 
-@pytest.mark.asyncio
 async def test_health_check(client: AsyncClient):
     """Test health check endpoint."""
     response = await client.get("/health")
@@ -15,7 +13,6 @@ async def test_health_check(client: AsyncClient):
     assert "timestamp" in data
 
 
-@pytest.mark.asyncio
 async def test_get_models(client: AsyncClient):
     """Test models endpoint."""
     response = await client.get("/api/models")
@@ -26,7 +23,6 @@ async def test_get_models(client: AsyncClient):
     assert len(data["models"]) == 3
 
 
-@pytest.mark.asyncio
 async def test_create_chat(client: AsyncClient):
     """Test creating a new chat."""
     response = await client.post("/api/chats", json={"title": "Test Chat"})
@@ -37,7 +33,6 @@ async def test_create_chat(client: AsyncClient):
     assert "created_at" in data
 
 
-@pytest.mark.asyncio
 async def test_create_chat_default_title(client: AsyncClient):
     """Test creating a chat with default title."""
     response = await client.post("/api/chats", json={})
@@ -46,7 +41,6 @@ async def test_create_chat_default_title(client: AsyncClient):
     assert data["title"] == "New Chat"
 
 
-@pytest.mark.asyncio
 async def test_list_chats(client: AsyncClient):
     """Test listing chats."""
     # Create a few chats first
@@ -60,7 +54,6 @@ async def test_list_chats(client: AsyncClient):
     assert len(data) >= 2
 
 
-@pytest.mark.asyncio
 async def test_get_chat(client: AsyncClient):
     """Test getting a single chat."""
     # Create a chat
@@ -76,14 +69,12 @@ async def test_get_chat(client: AsyncClient):
     assert "messages" in data
 
 
-@pytest.mark.asyncio
 async def test_get_nonexistent_chat(client: AsyncClient):
     """Test getting a chat that doesn't exist."""
     response = await client.get("/api/chats/nonexistent-id")
     assert response.status_code == 404
 
 
-@pytest.mark.asyncio
 async def test_delete_chat(client: AsyncClient):
     """Test deleting a chat."""
     # Create a chat
@@ -99,7 +90,6 @@ async def test_delete_chat(client: AsyncClient):
     assert get_response.status_code == 404
 
 
-@pytest.mark.asyncio
 async def test_update_chat(client: AsyncClient):
     """Test updating a chat title."""
     # Create a chat
@@ -112,3 +102,136 @@ async def test_update_chat(client: AsyncClient):
     data = response.json()
     assert data["title"] == "Updated"
 
+
+class _FakeRedis:
+    """Minimal in-memory stand-in for the redis.asyncio calls the chat cache uses."""
+
+    def __init__(self):
+        self.data = {}
+        self.ttls = {}
+
+    async def get(self, key):
+        return self.data.get(key)
+
+    async def set(self, key, value, nx=False, ex=None):
+        if nx and key in self.data:
+            return False
+        self.data[key] = value
+        return True
+
+    async def delete(self, key):
+        self.data.pop(key, None)
+
+    def pipeline(self, transaction=True):
+        return _FakePipeline(self)
+
+
+class _FakePipeline:
+    def __init__(self, redis):
+        self.redis = redis
+        self.keys = []
+
+    async def __aenter__(self):
+        return self
+
+    async def __aexit__(self, *exc):
+        return False
+
+    def incr(self, key):
+        self.keys.append(key)
+
+    def expire(self, key, seconds):
+        self.redis.ttls[key] = seconds
+
+    async def execute(self):
+        for key in self.keys:
+            self.redis.data[key] = int(self.redis.data.get(key, 0)) + 1
+
+
+async def test_chat_cache_invalidated_on_update(client: AsyncClient, monkeypatch):
+    """Test cached chat reads are served from Redis and refreshed after writes."""
+    from backend import database
+    fake = _FakeRedis()
+    monkeypatch.setattr(database, "redis_client", fake)
+
+    chat_id = (await client.post("/api/chats", json={"title": "Original"})).json()["id"]
+    assert (await client.get(f"/api/chats/{chat_id}")).json()["title"] == "Original"
+    assert f"chat:{chat_id}:v0" in fake.data
+
+    await client.patch(f"/api/chats/{chat_id}", json={"title": "Updated"})
+    assert (await client.get(f"/api/chats/{chat_id}")).json()["title"] == "Updated"
+    assert (await client.get("/api/chats")).json()[0]["title"] == "Updated"
+    assert f"chat:{chat_id}:ver" in fake.ttls
+
+
+async def test_chat_cache_lock_released_when_build_fails(client: AsyncClient, monkeypatch):
+    """Test the rebuild lock is dropped when building the payload raises (404)."""
+    from backend import database
+    fake = _FakeRedis()
+    monkeypatch.setattr(database, "redis_client", fake)
+
+    assert (await client.get("/api/chats/nonexistent-id")).status_code == 404
+    assert not [key for key in fake.data if key.endswith(":lock")]
+
+
+async def test_stream_saves_user_turn_and_answer(client: AsyncClient, monkeypatch):
+    """Test the streamed turn stores the user message, title and answer."""
+    import asyncio
+    from backend import main
+    from backend.schemas import ConsensusResponse
+    council_kwargs = {}
+
+    async def fake_stream(user_query, chat_history, files_context, **kwargs):
+        council_kwargs.update(kwargs)
+        await asyncio.sleep(0.01)  # Answer must get a later millisecond timestamp
+        yield "result", {
+            "initial_responses": [],
+            "discussion_rounds": [],
+            "consensus": ConsensusResponse(final_answer="Ответ"),
+        }
+
+    monkeypatch.setattr(main.orchestrator, "run_full_council_stream", fake_stream)
+
+    chat_id = (await client.post("/api/chats", json={})).json()["id"]
+    response = await client.post(f"/api/chats/{chat_id}/messages/stream", data={"content": "Вопрос"})
+    assert b'"type":"done"' in response.content
+    assert council_kwargs == {"force_refresh": False, "chat_id": chat_id}
+
+    chat = (await client.get(f"/api/chats/{chat_id}")).json()
+    assert chat["title"] == "Вопрос"
+    assert [m["role"] for m in chat["messages"]] == ["user", "assistant"]
+    assert chat["messages"][1]["content"] == "Ответ"
+
+
+async def test_with_heartbeats_fills_silence():
+    """Test heartbeats are yielded while the wrapped stream is silent."""
+    import asyncio
+    from backend.main import _with_heartbeats
+
+    async def slow_events():
+        yield "first"
+        await asyncio.sleep(0.05)
+        yield "second"
+
+    items = [item async for item in _with_heartbeats(slow_events(), interval=0.01)]
+    assert items[0] == "first"
+    assert items[-1] == "second"
+    assert None in items[1:-1]
+
+
+async def test_stream_keeps_user_message_when_council_fails(client: AsyncClient, monkeypatch):
+    """Test the user message is saved before the council runs."""
+    from backend import main
+
+    async def failing_stream(user_query, chat_history, files_context, **kwargs):
+        raise RuntimeError("council down")
+        yield
+
+    monkeypatch.setattr(main.orchestrator, "run_full_council_stream", failing_stream)
+
+    chat_id = (await client.post("/api/chats", json={})).json()["id"]
+    response = await client.post(f"/api/chats/{chat_id}/messages/stream", data={"content": "Вопрос"})
+    assert b'"type":"error"' in response.content
+
+    chat = (await client.get(f"/api/chats/{chat_id}")).json()
+    assert [m["content"] for m in chat["messages"]] == ["Вопрос"]
@@ -1,49 +1,88 @@
 """
 Council logic tests.
 """
+import re
 import pytest
+from types import MappingProxyType
 from unittest.mock import AsyncMock, patch
 
-from backend.council import CouncilOrchestrator
-from backend.schemas import StageProgressEvent
+from backend.council import CouncilOrchestrator, _parse_json_response
+from backend.schemas import (
+    StageProgressEvent,
+    ModelMessageResponse,
+    StageType,
+    DiscussionRound,
+    ConsensusResponse,
+)
 
+pytestmark = pytest.mark.unit
 
-@pytest.fixture
+
+_MODELS = (
+    MappingProxyType({"name": "GPT"}),
+    MappingProxyType({"name": "Gemini"}),
+    MappingProxyType({"name": "Claude"}),
+)
+_ANON_NAME_RE = re.compile(r"Модель [А-Я]")
+_PAIRS = tuple(zip(_MODELS, ("Response from GPT", "Response from Gemini", "Response from Claude")))
+
+
+def _model_response(
+    model: dict,
+    content: str,
+    stage: StageType = StageType.DISCUSSION,
+    round_number: int = 1,
+    **fields
+) -> ModelMessageResponse:
+    """Unvalidated ModelMessageResponse for a council model config; fields override defaults."""
+    return ModelMessageResponse.model_construct(**{
+        "model_id": model["id"],
+        "model_name": model["name"],
+        "model_color": model.get("color", "#000000"),
+        "content": content,
+        "confidence": 0.8,
+        "key_points": [],
+        "stage": stage,
+        "round_number": round_number,
+        **fields,
+    })
+
+
+@pytest.fixture(scope="module")
 def orchestrator():
-    """Create orchestrator instance."""
+    """
+    Orchestrator shared by the module's read-only tests.
+    
+    Tests that fill the result cache use fresh_orchestrator instead.
+    """
+    return CouncilOrchestrator()
+
+
+@pytest.fixture
+def fresh_orchestrator():
+    """Orchestrator with an empty result cache, for tests that run the full council."""
     return CouncilOrchestrator()
 
 
 def test_anonymize_model_name(orchestrator):
     """Test model name anonymization."""
-    assert orchestrator._anonymize_model_name(0) == "Model A"
-    assert orchestrator._anonymize_model_name(1) == "Model B"
-    assert orchestrator._anonymize_model_name(2) == "Model C"
+    names = tuple(orchestrator._anonymize_model_name(i) for i in range(3))
+    assert names == ("Модель А", "Модель Б", "Модель В")
 
 
 def test_format_responses_for_discussion(orchestrator):
     """Test formatting responses for discussion."""
-    responses = [
-        ({"name": "GPT"}, "Response from GPT"),
-        ({"name": "Gemini"}, "Response from Gemini"),
-        ({"name": "Claude"}, "Response from Claude"),
-    ]
-    
     # Format all responses
-    formatted = orchestrator._format_responses_for_discussion(responses)
-    assert "Model A" in formatted
-    assert "Model B" in formatted
-    assert "Model C" in formatted
+    formatted = orchestrator._format_responses_for_discussion(_PAIRS)
+    assert set(_ANON_NAME_RE.findall(formatted)) == {"Модель А", "Модель Б", "Модель В"}
     assert "Response from GPT" in formatted
     
     # Format excluding index 0
-    formatted_excluding = orchestrator._format_responses_for_discussion(responses, exclude_index=0)
-    assert "Model A" not in formatted_excluding
-    assert "Model B" in formatted_excluding
+    formatted_excluding = orchestrator._format_responses_for_discussion(_PAIRS, exclude_index=0)
+    assert set(_ANON_NAME_RE.findall(formatted_excluding)) == {"Модель Б", "Модель В"}
 
 
-@pytest.mark.asyncio
-async def test_run_initial_stage_mock(orchestrator):
+async def test_run_initial_stage_mock(orchestrator, monkeypatch):
     """Test initial stage with mocked API."""
     mock_responses = [
         "GPT's initial response",
@@ -51,38 +90,26 @@ async def test_run_initial_stage_mock(orchestrator):
         "Claude's initial response",
     ]
     
-    with patch.object(
-        orchestrator,
-        'run_initial_stage',
-        new_callable=AsyncMock,
-        return_value=mock_responses
-    ):
-        result = await orchestrator.run_initial_stage("Test query")
-        assert len(result) == 3
-
-
-@pytest.mark.asyncio
-async def test_progress_callback():
+    async def fake_initial_stage(*args, **kwargs):
+        return mock_responses
+
+    monkeypatch.setattr(orchestrator, 'run_initial_stage', fake_initial_stage)
+    result = await orchestrator.run_initial_stage("Test query")
+    assert len(result) == 3
+
+
+async def test_progress_callback(orchestrator, mock_parallel_completions):
     """Test progress callback is called."""
-    orchestrator = CouncilOrchestrator()
     progress_events = []
     
     async def mock_callback(event: StageProgressEvent):
         progress_events.append(event)
     
-    # Mock the parallel_completions to return quickly
-    with patch('backend.council.client.parallel_completions', new_callable=AsyncMock) as mock:
-        mock.return_value = [
-            "Response 1",
-            "Response 2",
-            "Response 3",
-        ]
-        
-        await orchestrator.run_initial_stage("Test", on_progress=mock_callback)
-        
-        # Should have progress events
-        assert len(progress_events) >= 1
-        assert any(e.stage.value == "initial" for e in progress_events)
+    await orchestrator.run_initial_stage("Test", on_progress=mock_callback)
+    
+    # Should have progress events
+    assert progress_events
+    assert StageType.INITIAL in {e.stage for e in progress_events}
 
 
 def test_council_models_configuration(orchestrator):
@@ -100,3 +127,151 @@ def test_council_models_configuration(orchestrator):
     assert orchestrator.chairman is not None
     assert orchestrator.chairman["role"] == "chairman"
 
+
+async def test_discussion_round_shares_responses_block(orchestrator, mock_parallel_completions):
+    """Test all discussion requests reuse the same initial responses block."""
+    initial = [
+        _model_response(model, f"Initial from {model['name']}", StageType.INITIAL, 0)
+        for model in orchestrator.models
+    ]
+
+    mock_parallel_completions.return_value = ["{}"] * len(orchestrator.models)
+    await orchestrator.run_discussion_round("Test", initial, [], 1)
+
+    requests = mock_parallel_completions.call_args[0][0]
+    user_messages = [
+        "\n".join(part["text"] for part in req["messages"][1]["content"])
+        for req in requests
+    ]
+    for i, content in enumerate(user_messages):
+        for resp in initial:
+            assert resp.content in content
+        assert f"(Твой собственный ответ — {orchestrator._anonymize_model_name(i)})" in content
+
+
+def test_toon_encode_responses(orchestrator):
+    """Test TOON encoding of uniform response records."""
+    encoded = orchestrator._toon_encode_responses([
+        {"model": "Модель А", "content": "Line 1\nLine 2, more", "confidence": 0.9, "key_points": ["a", "b"]},
+        {"model": "Модель Б", "content": "Short", "confidence": 0.5, "key_points": []},
+    ])
+    lines = encoded.split("\n")
+    assert lines[0] == "responses[2]{model,content,confidence,key_points}:"
+    assert lines[1] == '  Модель А,"Line 1\\nLine 2, more",0.9,[a|b]'
+    assert lines[2] == "  Модель Б,Short,0.5,[]"
+
+
+async def test_full_council_result_cached(fresh_orchestrator):
+    """Test repeated queries reuse the cached council result."""
+    orchestrator = fresh_orchestrator
+    response = _model_response({"id": "test/model", "name": "Test"}, "Agreed", confidence=1.0)
+    initial = AsyncMock(return_value=[response])
+    discussion = AsyncMock(return_value=DiscussionRound.model_construct(round_number=1, responses=[response]))
+    consensus = AsyncMock(return_value=ConsensusResponse.model_construct(final_answer="Answer"))
+
+    with patch.object(orchestrator, "run_initial_stage", initial), \
+         patch.object(orchestrator, "run_discussion_round", discussion), \
+         patch.object(orchestrator, "run_consensus_stage", consensus):
+        first = await orchestrator.run_full_council("Same question")
+        second = await orchestrator.run_full_council("Same question")
+        assert second["consensus"] is first["consensus"]
+        assert initial.await_count == 1
+
+        await orchestrator.run_full_council("Same question", force_refresh=True)
+        assert initial.await_count == 2
+
+        # The cache is per chat
+        await orchestrator.run_full_council("Same question", chat_id="other-chat")
+        assert initial.await_count == 3
+
+
+def test_response_similarity(orchestrator):
+    """Test round-to-round similarity used for early discussion exit."""
+    def response(name, content):
+        return _model_response({"id": name, "name": name}, content)
+
+    previous = [response("A", "The answer is 42"), response("B", "Use a hash map")]
+    same = [response("A", "The answer is 42"), response("B", "Use a hash map")]
+    changed = [response("A", "The answer is 42"), response("B", "Completely different idea")]
+
+    assert orchestrator._response_similarity(previous, same) == 1.0
+    assert orchestrator._response_similarity(previous, changed) < 0.85
+
+
+async def test_consensus_stage_streams_chunks(orchestrator):
+    """Test chairman answer is streamed to progress callback chunk by chunk."""
+    progress_events = []
+
+    async def mock_callback(event: StageProgressEvent):
+        progress_events.append(event)
+
+    async def mock_stream(**kwargs):
+        for chunk in ["## Ответ", "\n\nИтог"]:
+            yield chunk
+
+    with patch('backend.council.client.chat_completion_stream', mock_stream):
+        consensus = await orchestrator.run_consensus_stage("Test", [], [], on_progress=mock_callback)
+
+    assert consensus.final_answer == "## Ответ\n\nИтог"
+    streamed = [e.partial_content for e in progress_events if e.status == "streaming"]
+    assert streamed == ["## Ответ", "\n\nИтог"]
+
+
+def test_format_discussion_context_summarizes_older_rounds(orchestrator):
+    """Test only the latest round is kept verbatim."""
+    def make_round(number):
+        return DiscussionRound.model_construct(round_number=number, responses=[
+            _model_response(
+                model, f"Full text of round {number}", round_number=number, key_points=[f"point {number}"]
+            )
+            for model in orchestrator.models
+        ])
+
+    context = orchestrator._format_discussion_context([make_round(1), make_round(2)])
+    assert "Full text of round 2" in context
+    assert "Full text of round 1" not in context
+    assert "point 1" in context
+
+
+def test_parse_json_response():
+    """Test JSON extraction from chatty or fenced model answers."""
+    assert _parse_json_response('{"content": "ok", "confidence": 0.9}') == {"content": "ok", "confidence": 0.9}
+    assert _parse_json_response('```json\n{"content": "ok"}\n```')["content"] == "ok"
+    assert _parse_json_response('Вот мой ответ: {"content": "ok"} Надеюсь, {это} поможет')["content"] == "ok"
+    assert _parse_json_response("Просто текст без JSON") is None
+
+
+async def test_single_model_skips_discussion(fresh_orchestrator):
+    """Test discussion stage is skipped when only one model is in the council."""
+    orchestrator = fresh_orchestrator
+    discussion = AsyncMock()
+    consensus = AsyncMock(return_value=ConsensusResponse.model_construct(final_answer="Answer"))
+
+    with patch.object(orchestrator, "models", orchestrator.models[:1]), \
+         patch.object(orchestrator, "run_initial_stage", AsyncMock(return_value=[])), \
+         patch.object(orchestrator, "run_discussion_round", discussion), \
+         patch.object(orchestrator, "run_consensus_stage", consensus):
+        result = await orchestrator.run_full_council("Question")
+
+    discussion.assert_not_awaited()
+    assert result["discussion_rounds"] == []
+
+
+async def test_full_council_stream_yields_progress_then_result(fresh_orchestrator):
+    """Test the streaming council run forwards progress events before the result."""
+    orchestrator = fresh_orchestrator
+    event = StageProgressEvent(stage=StageType.INITIAL, model_name="Test", status="completed")
+
+    async def initial(user_query, chat_history, on_progress, files_context):
+        await on_progress(event)
+        return []
+
+    consensus = AsyncMock(return_value=ConsensusResponse.model_construct(final_answer="Answer"))
+    with patch.object(orchestrator, "models", orchestrator.models[:1]), \
+         patch.object(orchestrator, "run_initial_stage", initial), \
+         patch.object(orchestrator, "run_consensus_stage", consensus):
+        events = [e async for e in orchestrator.run_full_council_stream("Question")]
+
+    assert events[0] == ("progress", event)
+    assert events[-1][0] == "result"
+    assert events[-1][1]["consensus"].final_answer == "Answer"
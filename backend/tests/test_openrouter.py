@@ -0,0 +1,102 @@
+"""
+OpenRouter client tests.
+"""
+import pytest
+import httpx
+
+from backend.openrouter import OpenRouterClient, ModelError
+
+pytestmark = pytest.mark.unit
+
+
+def _client_with_body(body: bytes, chunk_size: int) -> OpenRouterClient:
+    """Client whose HTTP transport returns body in chunk_size pieces."""
+    async def stream():
+        for i in range(0, len(body), chunk_size):
+            yield body[i:i + chunk_size]
+
+    def handler(request):
+        return httpx.Response(200, content=stream())
+
+    client = OpenRouterClient()
+    client._client = httpx.AsyncClient(transport=httpx.MockTransport(handler))
+    return client
+
+
+@pytest.mark.parametrize("chunk_size", [1, 7, 4096])
+async def test_chat_completion_stream_parses_sse(chunk_size):
+    """Test SSE events split across arbitrary chunks are parsed in order."""
+    body = (
+        b": OPENROUTER PROCESSING\n\n"
+        b'data: {"choices":[{"delta":{"content":"\xd0\x9f\xd1\x80\xd0\xb8"}}]}\n\n'
+        b'data: {"choices":[{"delta":{"role":"assistant"}}]}\n\n'
+        b"data: not json\n\n"
+        b'data: {"choices":[{"delta":{"content":"vet"}}]}\n\n'
+        b"data: [DONE]\n\n"
+        b'data: {"choices":[{"delta":{"content":"ignored"}}]}\n\n'
+    )
+    client = _client_with_body(body, chunk_size)
+    chunks = [c async for c in client.chat_completion_stream("test/model", [])]
+    assert chunks == ["При", "vet"]
+
+
+@pytest.mark.parametrize("chunk_size", [1, 7, 4096])
+async def test_chat_completion_stream_handles_crlf_and_unterminated_event(chunk_size):
+    """Test CRLF-delimited events are split and a final event without a blank line is kept."""
+    body = (
+        b": OPENROUTER PROCESSING\r\n\r\n"
+        b'data: {"choices":[{"delta":{"content":"a"}}]}\r\n\r\n'
+        b'data: {"choices":[{"delta":{"content":"b"}}]}\r\n'
+    )
+    client = _client_with_body(body, chunk_size)
+    chunks = [c async for c in client.chat_completion_stream("test/model", [])]
+    assert chunks == ["a", "b"]
+
+
+async def test_parallel_completions_returns_model_error():
+    """Test a failing model yields a ModelError while the others still answer."""
+    def handler(request):
+        if b"bad/model" in request.content:
+            return httpx.Response(400, json={"error": "bad request"})
+        return httpx.Response(200, json={"choices": [{"message": {"content": "ok"}}]})
+
+    client = OpenRouterClient()
+    client._client = httpx.AsyncClient(transport=httpx.MockTransport(handler))
+    results = await client.parallel_completions([
+        {"model": "good/model", "messages": []},
+        {"model": "bad/model", "messages": []},
+    ])
+
+    assert results[0] == "ok"
+    assert isinstance(results[1], ModelError)
+    assert results[1].model == "bad/model"
+
+
+async def test_stream_with_retry_falls_back_on_overload(monkeypatch):
+    """Test a stream rejected with 503 is retried as a regular completion."""
+    monkeypatch.setattr("backend.openrouter.RETRY_BASE_DELAY_SECONDS", 0)
+    calls = []
+
+    def handler(request):
+        calls.append(b'"stream":true' in request.content)
+        if len(calls) == 1:
+            return httpx.Response(503, json={"error": "overloaded"})
+        return httpx.Response(200, json={"choices": [{"message": {"content": "ok"}}]})
+
+    client = OpenRouterClient()
+    client._client = httpx.AsyncClient(transport=httpx.MockTransport(handler))
+    chunks = [c async for c in client.stream_with_retry({"model": "test/model", "messages": []})]
+
+    assert chunks == ["ok"]
+    assert calls == [True, False]
+
+
+async def test_parallel_completions_raises_unexpected_error_unwrapped():
+    """Test a non-HTTP failure propagates as itself rather than an ExceptionGroup."""
+    def handler(request):
+        raise RuntimeError("boom")
+
+    client = OpenRouterClient()
+    client._client = httpx.AsyncClient(transport=httpx.MockTransport(handler))
+    with pytest.raises(RuntimeError, match="boom"):
+        await client.parallel_completions([{"model": "test/model", "messages": []}])
@@ -6,23 +6,19 @@ from pydantic import ValidationError
 
 from backend.schemas import (
     ModelResponse,
-    ConsensusResponse,
     ChatCreate,
     MessageCreate,
+    ModelMessageResponse,
     StageType,
     MessageRole,
 )
 
+pytestmark = pytest.mark.unit
 
-def test_model_response_valid():
+
+def test_model_response_valid(sample_model_response):
     """Test valid ModelResponse creation."""
-    response = ModelResponse(
-        content="This is a test response",
-        confidence=0.85,
-        agrees_with=["Model A", "Model B"],
-        key_points=["Point 1", "Point 2"],
-        disagreements=[]
-    )
+    response = sample_model_response
     assert response.content == "This is a test response"
     assert response.confidence == 0.85
     assert len(response.agrees_with) == 2
@@ -36,34 +32,44 @@ def test_model_response_defaults():
     assert response.key_points == []
 
 
-def test_model_response_confidence_bounds():
-    """Test confidence must be between 0 and 1."""
-    # Valid boundaries
-    ModelResponse(content="Test", confidence=0.0)
-    ModelResponse(content="Test", confidence=1.0)
-    
-    # Invalid: too high
-    with pytest.raises(ValidationError):
-        ModelResponse(content="Test", confidence=1.5)
-    
-    # Invalid: too low
+@pytest.mark.parametrize("confidence", [0.0, 1.0])
+def test_model_response_confidence_bounds(confidence):
+    """Test confidence boundaries 0 and 1 are accepted."""
+    assert ModelResponse(content="Test", confidence=confidence).confidence == confidence
+
+
+@pytest.mark.parametrize("confidence", [1.5, -0.1])
+def test_model_response_confidence_out_of_bounds(confidence):
+    """Test confidence outside 0..1 is rejected."""
     with pytest.raises(ValidationError):
-        ModelResponse(content="Test", confidence=-0.1)
+        ModelResponse(content="Test", confidence=confidence)
 
 
-def test_consensus_response_valid():
+def test_consensus_response_valid(sample_consensus_response):
     """Test valid ConsensusResponse creation."""
-    response = ConsensusResponse(
-        final_answer="The consensus answer",
-        consensus_reached=True,
-        summary="All models agreed",
-        key_agreements=["Point 1"],
-        key_disagreements=[]
-    )
+    response = sample_consensus_response
     assert response.final_answer == "The consensus answer"
     assert response.consensus_reached is True
 
 
+def test_model_message_response_frozen():
+    """Test council responses are immutable with percent-precision confidence."""
+    response = ModelMessageResponse(
+        model_id="test/model",
+        model_name="Test",
+        model_color="#000000",
+        content="Answer",
+        confidence=0.8333,
+        key_points=[],
+        stage=StageType.DISCUSSION,
+        round_number=1
+    )
+    assert response.confidence == 0.83
+
+    with pytest.raises(ValidationError):
+        response.content = "Changed"
+
+
 def test_chat_create():
     """Test ChatCreate schema."""
     # With title
@@ -81,16 +87,15 @@ def test_message_create():
     assert message.content == "Hello, council!"
 
 
-def test_stage_type_enum():
-    """Test StageType enum values."""
-    assert StageType.INITIAL.value == "initial"
-    assert StageType.DISCUSSION.value == "discussion"
-    assert StageType.CONSENSUS.value == "consensus"
-
-
-def test_message_role_enum():
-    """Test MessageRole enum values."""
-    assert MessageRole.USER.value == "user"
-    assert MessageRole.ASSISTANT.value == "assistant"
-    assert MessageRole.SYSTEM.value == "system"
+@pytest.mark.parametrize("enum_member, expected", [
+    (StageType.INITIAL, "initial"),
+    (StageType.DISCUSSION, "discussion"),
+    (StageType.CONSENSUS, "consensus"),
+    (MessageRole.USER, "user"),
+    (MessageRole.ASSISTANT, "assistant"),
+    (MessageRole.SYSTEM, "system"),
+])
+def test_enum_values(enum_member, expected):
+    """Test StageType and MessageRole enum values."""
+    assert enum_member.value == expected
 
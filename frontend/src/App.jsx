@@ -126,6 +126,7 @@ function App() {
       initialResponses: null,
       discussionRounds: [],
       consensus: null,
+      consensusDraft: '',
     };
     setDiscussionState(initialState);
     discussionStateRef.current = initialState;
@@ -142,11 +143,18 @@ function App() {
       files,
       onProgress: (progress) => {
         setDiscussionState(prev => {
-          const newState = {
-            ...prev,
-            stage: progress.stage,
-            progress: [...(prev?.progress || []), progress],
-          };
+          // Streaming chunks of the chairman's answer are accumulated, not listed
+          const newState = progress.status === 'streaming'
+            ? {
+                ...prev,
+                stage: progress.stage,
+                consensusDraft: (prev?.consensusDraft || '') + (progress.partial_content || ''),
+              }
+            : {
+                ...prev,
+                stage: progress.stage,
+                progress: [...(prev?.progress || []), progress],
+              };
           discussionStateRef.current = newState;
           return newState;
         });
@@ -100,6 +100,20 @@ const ChatView = memo(function ChatView({
                   isLive={true}
                 />
               )}
+
+              {/* Chairman's answer as it is being written */}
+              {discussionState.consensusDraft && !discussionState.consensus && (
+                <MessageBubble
+                  message={{
+                    id: 'consensus-draft',
+                    role: 'assistant',
+                    content: discussionState.consensusDraft,
+                    created_at: new Date().toISOString(),
+                  }}
+                  isExpanded={false}
+                  onToggleExpand={() => {}}
+                />
+              )}
             </div>
           )}
 